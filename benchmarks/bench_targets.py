@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+"""
+Microbenchmark for the markdown formatting helpers of the output targets.
+
+Run from the top of the source tree with:
+
+    % python3 benchmarks/bench_targets.py
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openscad_docsgen.target import target_classes
+
+
+NAMES = ["cuboid()", "prismoid()", "rect_tube()", "path_sweep()", "vnf_vertex_array()", "attach()", "CENTER", "BOTTOM"]
+SYNOPSES = [
+    "Creates a cube with chamfering and roundovers.",
+    "Creates a `prismoid()` shape between two rectangles & returns a <VNF>.",
+    "Sweeps a 2d shape along a path_like thing.",
+]
+HEADERS = ["Function&Module: cuboid()", "Section: Cuboids, Prismoids and Pyramids", "Module: attach()"]
+
+
+def bench(target, repeat=5, number=2000):
+    cases = [
+        ("escape_entities", lambda: [target.escape_entities(x) for x in SYNOPSES]),
+        ("header_link", lambda: [target.header_link(x) for x in HEADERS]),
+        ("get_link", lambda: [
+            target.get_link(name, anchor=target.header_link("Function: " + name), file="shapes3d.scad")
+            for name in NAMES
+        ]),
+        ("header", lambda: [target.header(x, lev=2) for x in HEADERS]),
+    ]
+    for label, func in cases:
+        best = min(timeit.repeat(func, repeat=repeat, number=number))
+        print("  {:16s} {:8.2f} us/call".format(label, best * 1e6 / number))
+
+
+def main():
+    for name, cls in sorted(target_classes.items()):
+        print("{}:".format(name))
+        bench(cls(project_name="Bench", docs_dir="docs"))
+
+
+if __name__ == "__main__":
+    main()
+
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 nowrap
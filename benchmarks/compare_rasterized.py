@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+"""
+Checks that 2D example images drawn from SVG exports, as with the -R flag,
+match the images OpenSCAD's own OpenGL renderer makes of the same scripts.
+Needs OpenSCAD, with a display it can render with.
+
+Run from the top of the source tree with:
+
+    % python3 benchmarks/compare_rasterized.py [SCRIPT.scad ...]
+
+Each given file is used as the script of one 2D example.  Without any, a
+built-in set of 2D scripts is used.  Exits with an error if any image
+differs by more than the allowed fraction of pixels.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageChops
+
+from openscad_docsgen.imagemanager import image_manager, ImageRequest
+
+
+SCRIPTS = [
+    ["square(10);"],
+    ["square(10, center=true);"],
+    ["circle(d=20, $fn=64);"],
+    ["difference() { square(20, center=true); circle(d=10, $fn=32); }"],
+    ["polygon([[0,0], [30,0], [15,20]]);"],
+    ["translate([40,10]) square([5,30]);"],
+    ["for (i = [0:4]) translate([i*12,0]) circle(d=8, $fn=24);"],
+]
+
+
+def differing_fraction(file1, file2, tolerance):
+    """Returns the fraction of pixels that differ between the two images by
+    more than the tolerance, in any channel."""
+    with Image.open(file1) as img1, Image.open(file2) as img2:
+        img1 = img1.convert("RGB")
+        img2 = img2.convert("RGB")
+        if img1.size != img2.size:
+            return 1.0
+        diff = ImageChops.difference(img1, img2)
+    bands = [band.point(lambda x: 255 if x > tolerance else 0) for band in diff.split()]
+    mask = ImageChops.lighter(ImageChops.lighter(bands[0], bands[1]), bands[2])
+    return mask.histogram()[255] / float(img1.size[0] * img1.size[1])
+
+
+def compare(num, script_lines, meta, tolerance):
+    """Renders the given 2D script both ways, and returns the fraction of
+    pixels that differ, or None if either way failed."""
+    req = ImageRequest("compare", num, "compare_{}.png".format(num), script_lines, meta)
+    gl_file = os.path.join(image_manager.scratch_dir, "gl_{}.png".format(num))
+    raster_file = os.path.join(image_manager.scratch_dir, "raster_{}.png".format(num))
+    osc = image_manager._run_openscad(req, req.script_lines, gl_file, None)
+    if not image_manager._render_ok(osc):
+        print("  {}: OpenSCAD render failed".format(num))
+        return None
+    if not image_manager._rasterizes(req) or image_manager._export_svg(req, raster_file) is None:
+        print("  {}: SVG export failed".format(num))
+        return None
+    if not image_manager._rasterize(*image_manager._rasters.pop(req)):
+        print("  {}: SVG drawing failed".format(num))
+        return None
+    return differing_fraction(gl_file, raster_file, tolerance)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', '--max-diff', type=float, default=0.02,
+                        help='The largest fraction of pixels allowed to differ.  Default: 0.02')
+    parser.add_argument('-t', '--tolerance', type=int, default=48,
+                        help='How much a channel of a pixel can differ by before it counts.  Default: 48')
+    parser.add_argument('-M', '--meta', default="2D",
+                        help='The image metadata to render with, like "2D,Med".  Default: 2D')
+    parser.add_argument('scripts', nargs='*', help='The 2D scripts to compare.')
+    args = parser.parse_args()
+
+    scripts = SCRIPTS
+    if args.scripts:
+        scripts = []
+        for filename in args.scripts:
+            with open(filename, "r") as f:
+                scripts.append(f.read().splitlines())
+    meta = args.meta if "2D" in args.meta else "2D," + args.meta
+    image_manager.rasterize_2d = True
+
+    fail = False
+    for num, script_lines in enumerate(scripts, 1):
+        frac = compare(num, script_lines, meta, args.tolerance)
+        if frac is None:
+            fail = True
+            continue
+        ok = frac <= args.max_diff
+        fail = fail or not ok
+        print("  {}: {:6.2%} of pixels differ{}".format(num, frac, "" if ok else "  FAIL"))
+    sys.exit(1 if fail else 0)
+
+
+if __name__ == "__main__":
+    main()
+
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 nowrap
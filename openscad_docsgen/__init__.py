@@ -13,12 +13,15 @@ from .errorlog import ErrorLog, errorlog
 from .parser import DocsGenParser, DocsGenException
 from .target import default_target, target_classes
 from .logmanager import log_manager
+from .imagemanager import image_manager
+from .filehashes import FileHashes
+from .imagedigests import ImageDigests
 
 
 class Options(object):
     def __init__(self, args):
         self.files = args.srcfiles
-        self.target_profile = args.target_profile
+        self.target_profiles = args.target_profile
         self.project_name = args.project_name
         self.docs_dir = args.docs_dir.rstrip("/")
         self.quiet = args.quiet
@@ -33,9 +36,23 @@ class Options(object):
         self.gen_glossary = args.gen_glossary
         self.gen_cheat = args.gen_cheat
         self.gen_sidebar = args.gen_sidebar
+        self.gen_search = args.gen_search
+        self.split_indices = args.split_indices
         self.report = args.report
         self.dump_tree = args.dump_tree
+        self.export_json = args.export_json
+        self.export_sqlite = args.export_sqlite
+        self.manifest = args.manifest
+        self.gc_images = args.gc_images
         self.png_animation = args.png_animation
+        self.webp_animation = args.webp_animation
+        self.optimize_animations = args.optimize_animations
+        self.optimize_pngs = args.optimize_pngs
+        self.image_variants = args.image_variants
+        self.rasterize_2d = args.rasterize_2d
+        self.mesh_spins = args.mesh_spins
+        self.low_memory = args.low_memory
+        self.jobs = max(1, args.jobs)
         self.verbose = args.verbose
         self.enabled_features = [item.strip() for item in args.enabled_features.split(",")]
         self.sidebar_header = []
@@ -44,16 +61,67 @@ class Options(object):
         self.update_target()
 
     def set_target(self, targ):
-        if targ not in target_classes:
+        profiles = parse_target_profiles(targ)
+        if not profiles:
             return False
-        self.target_profile = targ
+        self.target_profiles = profiles
         return True
 
     def update_target(self):
-        self.target = target_classes[self.target_profile](
-            project_name=self.project_name,
-            docs_dir=self.docs_dir
+        # With more than one target profile, each gets its own subdirectory
+        # of the docs dir, since they would otherwise write the same files.
+        # They all share the images in the docs dir, which are the same.
+        multi = len(self.target_profiles) > 1
+        self.targets = [
+            target_classes[profile](
+                project_name=self.project_name,
+                docs_dir=os.path.join(self.docs_dir, profile) if multi else self.docs_dir,
+                images_dir=self.docs_dir
+            )
+            for profile in self.target_profiles
+        ]
+        self.target = self.targets[0]
+
+
+def parse_target_profiles(value):
+    """Parses a comma separated list of target profile names.
+    Returns None if any of them is unknown."""
+    profiles = []
+    for profile in value.split(","):
+        profile = profile.strip()
+        if profile not in target_classes:
+            return None
+        if profile not in profiles:
+            profiles.append(profile)
+    return profiles
+
+
+def _target_profiles_arg(value):
+    profiles = parse_target_profiles(value)
+    if not profiles:
+        raise argparse.ArgumentTypeError(
+            "invalid target profile list: '{}' (choose from {})".format(
+                value, ", ".join(sorted(target_classes.keys()))
+            )
         )
+    return profiles
+
+
+def _image_variants_arg(value):
+    """Parses a comma separated list of image variant scales, like `0.5,2`."""
+    scales = []
+    for scale in value.split(","):
+        try:
+            scale = float(scale.strip().rstrip("xX"))
+        except ValueError:
+            scale = 0
+        if scale <= 0 or scale == 1:
+            raise argparse.ArgumentTypeError(
+                "invalid image variant scale list: '{}'".format(value)
+            )
+        if scale not in scales:
+            scales.append(scale)
+    return sorted(scales)
 
 def processFiles(opts):
     docsgen = DocsGenParser(opts)
@@ -82,22 +150,55 @@ def processFiles(opts):
 
     if opts.dump_tree:
         docsgen.dump_full_tree()
+    if opts.export_json:
+        docsgen.write_json_file(opts.export_json)
+    if opts.export_sqlite:
+        docsgen.write_sqlite_file(opts.export_sqlite)
     log_manager.process_requests(test_only=opts.test_only)
     
+    image_manager.jobs = opts.jobs
+    image_manager.optimize_animations = opts.optimize_animations
+    image_manager.image_variants = opts.image_variants
+    image_manager.rasterize_2d = opts.rasterize_2d
+    image_manager.mesh_spins = opts.mesh_spins
+    image_manager.image_digests = ImageDigests(os.path.join(opts.docs_dir, ".image_digests"))
+    if opts.optimize_pngs:
+        image_manager.optimize_pngs = True
+        image_manager.optimized_hashes = FileHashes(os.path.join(opts.docs_dir, ".optimized_images"))
     if opts.gen_files or opts.test_only:
         docsgen.write_docs_files()
-    if opts.gen_toc:
-        docsgen.write_toc_file()
-    if opts.gen_index:
-        docsgen.write_index_file()
-    if opts.gen_topics:
-        docsgen.write_topics_file()
-    if opts.gen_glossary:
-        docsgen.write_glossary_file()
-    if opts.gen_cheat:
-        docsgen.write_cheatsheet_file()
-    if opts.gen_sidebar:
-        docsgen.write_sidebar_file()
+        image_manager.close_pool()
+    for target in opts.targets:
+        if opts.gen_toc:
+            docsgen.write_toc_file(target)
+        if opts.gen_index:
+            docsgen.write_index_file(target)
+        if opts.gen_topics:
+            docsgen.write_topics_file(target)
+        if opts.gen_glossary:
+            docsgen.write_glossary_file(target)
+        if opts.gen_cheat:
+            docsgen.write_cheatsheet_file(target)
+        if opts.gen_sidebar:
+            docsgen.write_sidebar_file(target)
+        if opts.gen_search:
+            docsgen.write_search_index(target)
+    if opts.gc_images:
+        docsgen.gc_images(delete=(opts.gc_images == "delete"))
+    if opts.manifest:
+        docsgen.write_manifest(opts.manifest)
+    if not opts.quiet:
+        docsgen.report_write_counts()
+        if image_manager.anim_count:
+            print("Encoded {} animations, saving {} bytes.".format(
+                image_manager.anim_count,
+                image_manager.anim_bytes_before - image_manager.anim_bytes_after
+            ))
+        if image_manager.png_count:
+            print("Optimized {} PNG images, saving {} bytes.".format(
+                image_manager.png_count,
+                image_manager.png_bytes_before - image_manager.png_bytes_after
+            ))
 
     if opts.report:
         errorlog.write_report()
@@ -119,7 +220,7 @@ def main():
     parser.add_argument('-S', '--strict', action="store_true",
                         help="If given, require File/LibFile and Section headers.")
     parser.add_argument('-f', '--force', action="store_true",
-                        help='If given, force regeneration of images.')
+                        help='If given, force regeneration of images and docs files.')
     parser.add_argument('-n', '--no-images', action="store_true",
                         help='If given, skips image generation.')
     parser.add_argument('-m', '--gen-files', action="store_true",
@@ -136,16 +237,45 @@ def main():
                         help='If given, generate CheatSheet.md file with all Usage lines.')
     parser.add_argument('-s', '--gen_sidebar', action="store_true",
                         help="If given, generate _Sidebar.md file index.")
+    parser.add_argument('-x', '--gen-search', action="store_true",
+                        help="If given, generate a sharded search index in the search/ subdirectory.")
+    parser.add_argument('-k', '--split-indices', action="store_true",
+                        help="If given, split the AlphaIndex and Topics files into a page per initial letter.")
+    parser.add_argument('-l', '--low-memory', action="store_true",
+                        help='If given, discard most of each file\'s parsed docs after writing its docs file, to reduce memory use.')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of worker processes to generate docs files with.  Defaults to 1.')
     parser.add_argument('-a', '--png-animation', action="store_true",
                         help='If given, animations are created using animated PNGs instead of GIFs.')
+    parser.add_argument('-w', '--webp-animation', action="store_true",
+                        help='If given, animations are created using animated WebPs instead of GIFs.')
+    parser.add_argument('-O', '--optimize-animations', action="store_true",
+                        help='If given, re-encode rendered animations to merge repeated frames and crop frames to the changed area.')
+    parser.add_argument('-V', '--image-variants', type=_image_variants_arg, default=[], metavar='SCALES',
+                        help='If given, a comma separated list of scales, like 0.5,2, to also make scaled copies of still images at.')
+    parser.add_argument('-R', '--rasterize-2d', action="store_true",
+                        help='If given, draw still 2D images from an SVG export, instead of with OpenSCAD\'s OpenGL renderer.')
+    parser.add_argument('-E', '--mesh-spins', action="store_true",
+                        help='If given, render the geometry of spinning Render mode images once, as a mesh, instead of for every frame.')
+    parser.add_argument('-z', '--optimize-pngs', action="store_true",
+                        help='If given, losslessly recompress rendered PNG images.  Images already optimized are skipped.')
     parser.add_argument('-P', '--project-name',
                         help='If given, sets the name of the project to be shown in titles.')
     parser.add_argument('-r', '--report', action="store_true",
                         help='If given, write all warnings and errors to docsgen_report.json')
     parser.add_argument('-d', '--dump-tree', action="store_true",
                         help='If given, dumps the documentation tree for debugging.')
-    parser.add_argument('-p', '--target-profile', choices=target_classes.keys(), default=default_target,
-                        help='Sets the output target profile.  Defaults to "{}"'.format(default_target))
+    parser.add_argument('-J', '--export-json', metavar='FILE',
+                        help='If given, exports the parsed documentation tree to the given JSON file.')
+    parser.add_argument('-Q', '--export-sqlite', metavar='FILE',
+                        help='If given, exports the parsed documentation tree to the given SQLite database file.')
+    parser.add_argument('-G', '--gc-images', choices=["list", "delete"],
+                        help='If given, lists or deletes images that are no longer used by the docs of any source file.')
+    parser.add_argument('-M', '--manifest', metavar='FILE',
+                        help='If given, writes a JSON manifest of all generated files, with their status and digest, to the given file.')
+    parser.add_argument('-p', '--target-profile', type=_target_profiles_arg, default=[default_target],
+                        help='Sets the output target profile, or a comma separated list of them ({}).  Defaults to "{}"'.format(
+                            ", ".join(sorted(target_classes.keys())), default_target))
     parser.add_argument('-e', '--enabled_features', default='', help='List of enabled experimental features')
     parser.add_argument('-v', '--verbose', help='Dump the openscad commands', action="store_true")
     parser.add_argument('srcfiles', nargs='*', help='List of input source files.')
@@ -0,0 +1,99 @@
+from __future__ import print_function
+
+import os
+import os.path
+
+from PIL import Image, ImageChops, ImageSequence
+
+from .fileclone import clone_file
+
+
+def _read_frames(infile, frame_ms):
+    """Reads the frames of an animation, merging identical consecutive frames.
+    Returns the list of frames, and the list of their durations in milliseconds.
+    Frames that don't give their own duration last `frame_ms` milliseconds.
+    """
+    frames = []
+    durations = []
+    with Image.open(infile) as img:
+        for frame in ImageSequence.Iterator(img):
+            duration = frame.info.get("duration") or frame_ms
+            frame = frame.convert("RGB")
+            if frames and ImageChops.difference(frame, frames[-1]).getbbox() is None:
+                durations[-1] += duration
+                continue
+            frames.append(frame)
+            durations.append(duration)
+    return frames, durations
+
+
+def _shared_palette(frames, lossy=False):
+    """Converts all the frames to palette mode, using a single palette built
+    from all of them.  If the frames have more than 256 colors between them,
+    they are returned unchanged, unless `lossy` is true, in which case the
+    palette approximates them.
+    """
+    width, height = frames[0].size
+    montage = Image.new("RGB", (width, height * len(frames)))
+    for i, frame in enumerate(frames):
+        montage.paste(frame, (0, height * i))
+    colors = montage.getcolors(256)
+    if colors is not None:
+        palette = Image.new("P", (1, 1))
+        flat = [chan for count, rgb in colors for chan in rgb]
+        palette.putpalette(flat + flat[:3] * (256 - len(colors)))
+    elif lossy:
+        palette = montage.quantize(colors=256, method=Image.Quantize.MEDIANCUT)
+    else:
+        return frames
+    return [frame.quantize(palette=palette, dither=Image.Dither.NONE) for frame in frames]
+
+
+def encode_animation(infile, outfile, frame_ms):
+    """Re-encodes the animation in `infile` as an optimized animation in
+    `outfile`.  The format is picked from the extension of `outfile`, and can
+    be an animated GIF, PNG or WebP.  `infile` and `outfile` may be the same.
+
+    Identical consecutive frames are merged into one, with their durations
+    added together.  GIF and PNG frames share a single palette, and each frame
+    after the first only stores the region that changed from the frame before.
+
+    If `outfile` is the same format as `infile`, and the new encoding
+    isn't smaller, `infile` is put at `outfile` unchanged instead.
+
+    Returns the size in bytes of `infile` and of the new `outfile`.
+    """
+    old_size = os.path.getsize(infile)
+    frames, durations = _read_frames(infile, frame_ms)
+    file_ext = os.path.splitext(outfile)[1].lower()
+    outdir, outname = os.path.split(outfile)
+    tmpfile = os.path.join(outdir, "tmp_enc_{}".format(outname))
+    try:
+        if file_ext == ".webp":
+            frames[0].save(
+                tmpfile, format="WEBP", save_all=True, append_images=frames[1:],
+                duration=durations, loop=0, lossless=True, quality=100, method=6,
+                minimize_size=True,
+            )
+        else:
+            is_gif = (file_ext == ".gif")
+            frames = _shared_palette(frames, lossy=is_gif)
+            # Pillow's GIF and APNG writers crop each frame to its
+            # difference from the previous one.
+            frames[0].save(
+                tmpfile, format="GIF" if is_gif else "PNG", save_all=True,
+                append_images=frames[1:], duration=durations, loop=0,
+                optimize=True,
+            )
+        in_ext = os.path.splitext(infile)[1].lower()
+        if in_ext != file_ext or os.path.getsize(tmpfile) < old_size:
+            os.replace(tmpfile, outfile)
+        elif infile != outfile:
+            clone_file(infile, outfile)
+    finally:
+        if os.path.exists(tmpfile):
+            os.unlink(tmpfile)
+    return old_size, os.path.getsize(outfile)
+
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 nowrap
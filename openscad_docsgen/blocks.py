@@ -4,10 +4,12 @@ import os
 import os.path
 import re
 import sys
+import hashlib
 
 from .utils import flatten
 from .errorlog import ErrorLog, errorlog
 from .imagemanager import image_manager
+from .imagevariants import variant_file
 from .logmanager import log_manager
 
 
@@ -18,12 +20,43 @@ class DocsGenException(Exception):
         super().__init__('{} "{}"'.format(self.message, self.block))
 
 
+class RenderJob(object):
+    """
+    A single image render or log run that generating the docs would perform.
+    `kind` is either "image" or "log".  `image_file` is None for logs.
+    """
+    __slots__ = ("kind", "src_file", "src_line", "image_file", "script_lines", "meta", "digest", "block")
+
+    def __init__(self, kind, src_file, src_line, image_file, script_lines, meta, block):
+        self.kind = kind
+        self.src_file = src_file
+        self.src_line = src_line
+        self.image_file = image_file
+        self.script_lines = script_lines
+        self.meta = meta
+        self.block = block
+        h = hashlib.sha256()
+        h.update(meta.encode("utf-8"))
+        for line in script_lines:
+            h.update(b"\n")
+            h.update(line.encode("utf-8"))
+        self.digest = h.hexdigest()
+
+    @property
+    def identity(self):
+        return (self.kind, self.src_file, self.src_line, self.image_file)
+
+    def __str__(self):
+        return "{} {}:{} {}".format(self.kind, self.src_file, self.src_line, self.image_file or "")
+
+
 class GenericBlock(object):
+    __slots__ = ("title", "subtitle", "body", "origin", "parent", "children", "figure_num", "definitions")
     _link_pat = re.compile(r'^(.*?)\{\{([A-Za-z0-9_()]+)\}\}(.*)$')
 
     def __init__(self, title, subtitle, body, origin, parent=None):
-        self.title = title
-        self.subtitle = subtitle
+        self.title = sys.intern(title)
+        self.subtitle = sys.intern(subtitle)
         self.body = body
         self.origin = origin
         self.parent = parent
@@ -44,6 +77,25 @@ class GenericBlock(object):
             return self.parent.get_figure_num()
         return ""
 
+    def get_file_block(self):
+        block = self
+        while block.parent:
+            block = block.parent
+        return block
+
+    def note_link_target(self, name, controller):
+        """
+        Records a link target name on this block's FileBlock, unless it is an
+        item in the same file.  Cached docs for the file are invalidated when
+        one of its link targets changes.
+        """
+        item = controller.items_by_name.get(name)
+        if item is not None and item.origin.file == self.origin.file:
+            return
+        fblock = self.get_file_block()
+        if isinstance(fblock, FileBlock):
+            fblock.link_targets.add(name)
+
     def sort_children(self, front_blocks=(), back_blocks=()):
         children = []
         for blocks in front_blocks:
@@ -96,6 +148,7 @@ class GenericBlock(object):
                 name = m.group(2).lower().strip()
                 line = m.group(3)
                 literalize = name.endswith("()")
+                self.note_link_target(name, controller)
                 if name in controller.items_by_name:
                     item = controller.items_by_name[name]
                     oline += item.get_link(target, currfile=self.origin.file, literalize=literalize, html=html)
@@ -139,12 +192,26 @@ class GenericBlock(object):
     def get_cheatsheet_lines(self, controller, target):
         return []
 
+    def get_render_jobs(self, controller, target):
+        """Yields a RenderJob for each image or log that this block's subtree would need."""
+        for child in self.children:
+            yield from child.get_render_jobs(controller, target)
+
     def get_file_lines(self, controller, target):
         sub = self.parse_links(self.subtitle, controller, target)
-        out = target.block_header(self.title, sub)
-        out.extend(self.get_markdown_body(controller, target))
-        out.append("")
-        return out
+        yield from target.block_header(self.title, sub)
+        yield from self.get_markdown_body(controller, target)
+        yield ""
+
+    def strip_to_summary(self):
+        """
+        Drops all data that is only needed to write this block's own docs
+        file, keeping what the TOC, index, topics, cheatsheet and sidebar
+        files need.
+        """
+        self.body = []
+        self.children = []
+        self.definitions = {}
 
     def __eq__(self, other):
         return self.title == other.title and self.subtitle == other.subtitle
@@ -156,6 +223,8 @@ class GenericBlock(object):
 
 
 class LabelBlock(GenericBlock):
+    __slots__ = ()
+
     def __init__(self, title, subtitle, body, origin, parent=None):
         if body:
             raise DocsGenException(title, "Body not supported, while declaring block:")
@@ -163,6 +232,8 @@ class LabelBlock(GenericBlock):
 
 
 class SynopsisBlock(LabelBlock):
+    __slots__ = ()
+
     def __init__(self, title, subtitle, body, origin, parent=None):
         parent.synopsis = subtitle
         super().__init__(title, subtitle, body, origin, parent=parent)
@@ -170,11 +241,12 @@ class SynopsisBlock(LabelBlock):
     def get_file_lines(self, controller, target):
         sub = self.parse_links(self.subtitle, controller, target)
         sub = target.escape_entities(sub) + target.mouseover_tags(self.parent.syntags, htag="sup", wrap="[<abbr>{}</abbr>]")
-        out = target.block_header(self.title, sub, escsub=False)
-        return out
+        yield from target.block_header(self.title, sub, escsub=False)
 
 
 class SynTagsBlock(LabelBlock):
+    __slots__ = ()
+
     def __init__(self, title, subtitle, body, origin, parent, syntags_data={}):
         tags = [x.strip() for x in subtitle.split(",")]
         for tag in tags:
@@ -186,22 +258,25 @@ class SynTagsBlock(LabelBlock):
 
 
 class TopicsBlock(LabelBlock):
+    __slots__ = ("topics",)
+
     def __init__(self, title, subtitle, body, origin, parent=None):
         super().__init__(title, subtitle, body, origin, parent=parent)
-        self.topics = [x.strip() for x in subtitle.split(",")]
+        self.topics = [x.strip() for x in subtitle.split(",") if x.strip()]
         parent.topics = self.topics
 
     def get_file_lines(self, controller, target):
         links = [
-            target.get_link(topic, anchor=target.header_link(topic), file="Topics", literalize=False)
+            target.get_link(topic, anchor=target.header_link(topic), file=controller.get_topic_page(topic), literalize=False)
             for topic in self.topics
         ]
         links = ", ".join(links)
-        out = target.block_header(self.title, links)
-        return out
+        yield from target.block_header(self.title, links)
 
 
 class SeeAlsoBlock(LabelBlock):
+    __slots__ = ("see_also",)
+
     def __init__(self, title, subtitle, body, origin, parent=None):
         self.see_also = [x.strip() for x in subtitle.split(",")]
         parent.see_also = self.see_also
@@ -210,6 +285,7 @@ class SeeAlsoBlock(LabelBlock):
     def get_file_lines(self, controller, target):
         items = []
         for name in self.see_also:
+            self.note_link_target(name, controller)
             if name not in controller.items_by_name:
                 msg = "Invalid Link '{0}'".format(name)
                 errorlog.add_entry(self.origin.file, self.origin.line, msg, ErrorLog.FAIL)
@@ -221,13 +297,13 @@ class SeeAlsoBlock(LabelBlock):
             item.get_link(target, currfile=self.origin.file, literalize=False)
             for item in items
         ]
-        out = []
         links = ", ".join(links)
-        out.extend(target.block_header(self.title, links, escsub=False))
-        return out
+        yield from target.block_header(self.title, links, escsub=False)
 
 
 class HeaderlessBlock(GenericBlock):
+    __slots__ = ()
+
     def __init__(self, title, subtitle, body, origin, parent=None):
         if subtitle:
             body.insert(0, subtitle)
@@ -235,14 +311,14 @@ class HeaderlessBlock(GenericBlock):
         super().__init__(title, subtitle, body, origin, parent=parent)
 
     def get_file_lines(self, controller, target):
-        out = []
-        out.append("")
-        out.extend(self.get_markdown_body(controller, target))
-        out.append("")
-        return out
+        yield ""
+        yield from self.get_markdown_body(controller, target)
+        yield ""
 
 
 class TextBlock(GenericBlock):
+    __slots__ = ()
+
     def __init__(self, title, subtitle, body, origin, parent=None):
         if subtitle:
             body.insert(0, subtitle)
@@ -251,6 +327,8 @@ class TextBlock(GenericBlock):
 
 
 class DefinitionsBlock(GenericBlock):
+    __slots__ = ()
+
     def __init__(self, title, subtitle, body, origin, parent=None):
         super().__init__(title, subtitle, body, origin, parent=parent)
         terms = []
@@ -269,43 +347,46 @@ class DefinitionsBlock(GenericBlock):
             self.definitions[term] = (termset, defn)
 
     def get_file_lines(self, controller, target):
-        out = target.block_header(self.title, self.subtitle)
+        yield from target.block_header(self.title, self.subtitle)
         terms = list(self.definitions.keys())
         defs = {
                 key: self.parse_links(info[1], controller, target, html=True)
                 for key, info in self.definitions.items()
             }
         for term in terms:
-            out.extend(target.markdown_block(["{}: {}".format(term.title(), defs[term])]))
-        out.append("")
-        return out
+            yield from target.markdown_block(["{}: {}".format(term.title(), defs[term])])
+        yield ""
 
 
 class BulletListBlock(GenericBlock):
+    __slots__ = ()
+
     def __init__(self, title, subtitle, body, origin, parent=None):
         super().__init__(title, subtitle, body, origin, parent=parent)
 
     def get_file_lines(self, controller, target):
         sub = self.parse_links(self.subtitle, controller, target)
         sub = target.escape_entities(sub)
-        out = target.block_header(self.title, sub)
-        out.extend(target.bullet_list(self.body))
-        return out
+        yield from target.block_header(self.title, sub)
+        yield from target.bullet_list(self.body)
 
 
 class NumberedListBlock(GenericBlock):
+    __slots__ = ()
+
     def __init__(self, title, subtitle, body, origin, parent=None):
         super().__init__(title, subtitle, body, origin, parent=parent)
 
     def get_file_lines(self, controller, target):
         sub = self.parse_links(self.subtitle, controller, target)
         sub = target.escape_entities(sub)
-        out = target.block_header(self.title, sub)
-        out.extend(target.numbered_list(self.body))
-        return out
+        yield from target.block_header(self.title, sub)
+        yield from target.numbered_list(self.body)
 
 
 class TableBlock(GenericBlock):
+    __slots__ = ("header_sets",)
+
     def __init__(self, title, subtitle, body, origin, parent=None, header_sets=None):
         super().__init__(title, subtitle, body, origin, parent=parent)
         self.header_sets = header_sets
@@ -338,14 +419,15 @@ class TableBlock(GenericBlock):
             tables.append(table)
         sub = self.parse_links(self.subtitle, controller, target)
         sub = target.escape_entities(sub)
-        out = target.block_header(self.title, sub)
+        yield from target.block_header(self.title, sub)
         for tnum, table in enumerate(tables):
             headers = self.header_sets[tnum]
-            out.extend(target.table(headers,table))
-        return out
+            yield from target.table(headers,table)
 
 
 class FileBlock(GenericBlock):
+    __slots__ = ("includes", "common_code", "footnotes", "summary", "group", "link_targets", "_script_prefix")
+
     def __init__(self, title, subtitle, body, origin):
         super().__init__(title, subtitle, body, origin)
         self.includes = []
@@ -353,6 +435,8 @@ class FileBlock(GenericBlock):
         self.footnotes = []
         self.summary = ""
         self.group = ""
+        self.link_targets = set()
+        self._script_prefix = ()
 
     def get_data(self):
         d = super().get_data()
@@ -364,12 +448,36 @@ class FileBlock(GenericBlock):
             {
                 "mark": mark,
                 "note": note
-            } for mark, note in self.footnotes
+            } for mark, note, origin in self.footnotes
         ]
         skip_titles = ["CommonCode", "Includes"]
-        d["children"] = list(filter(lambda x: x["name"] not in skip_titles, d["children"]))
+        d["children"] = list(filter(lambda x: x["name"] not in skip_titles, d.get("children", [])))
         return d
 
+    def strip_to_summary(self):
+        sections = [
+            sect for sect in self.children
+            if isinstance(sect, SectionBlock)
+        ]
+        super().strip_to_summary()
+        self.children = sections
+        for sect in self.children:
+            sect.strip_to_summary()
+        self.includes = []
+        self.common_code = []
+        self.link_targets = set()
+        self._script_prefix = ()
+
+    def get_script_prefix(self):
+        """
+        Returns the Includes and CommonCode lines that start every script in
+        this file, as a tuple that is shared by all the examples using it.
+        """
+        # Includes and CommonCode only ever grow, so the length tells if the cache is stale.
+        if len(self._script_prefix) != len(self.includes) + len(self.common_code):
+            self._script_prefix = tuple(self.includes) + tuple(self.common_code)
+        return self._script_prefix
+
     def get_link(self, target, currfile=None, label="", literalize=False, html=False):
         file = self.origin.file
         if currfile is None or self.origin.file == currfile:
@@ -406,12 +514,10 @@ class FileBlock(GenericBlock):
             sect for sect in self.children
             if isinstance(sect, SectionBlock)
         ]
-        out = []
-        out.extend(target.numbered_list_start())
+        yield from target.numbered_list_start()
         for n, sect in enumerate(sections):
-            out.extend(sect.get_toc_lines(controller, target, n=n+1, currfile=currfile))
-        out.extend(target.numbered_list_end())
-        return out
+            yield from sect.get_toc_lines(controller, target, n=n+1, currfile=currfile)
+        yield from target.numbered_list_end()
 
     def get_cheatsheet_lines(self, controller, target):
         lines = []
@@ -423,40 +529,49 @@ class FileBlock(GenericBlock):
             out.extend(lines)
         return out
 
+    def get_render_jobs(self, controller, target):
+        for child in self.children:
+            if not isinstance(child, SectionBlock):
+                yield from child.get_render_jobs(controller, target)
+        for child in self.children:
+            if isinstance(child, SectionBlock):
+                yield from child.get_render_jobs(controller, target)
+
     def get_file_lines(self, controller, target):
-        out = target.header(str(self), lev=target.FILE)
-        out.extend(target.markdown_block(self.get_markdown_body(controller, target)))
+        yield from target.header(str(self), lev=target.FILE)
+        yield from target.markdown_block(self.get_markdown_body(controller, target))
         for child in self.children:
             if not isinstance(child, SectionBlock):
-                out.extend(child.get_file_lines(controller, target))
-        out.extend(target.header("File Contents", lev=target.SECTION))
-        out.extend(self.get_toc_lines(controller, target, currfile=self.origin.file))
+                yield from child.get_file_lines(controller, target)
+        yield from target.header("File Contents", lev=target.SECTION)
+        yield from self.get_toc_lines(controller, target, currfile=self.origin.file)
         for child in self.children:
             if isinstance(child, SectionBlock):
-                out.extend(child.get_file_lines(controller, target))
-        return out
+                yield from child.get_file_lines(controller, target)
 
     def get_figure_num(self):
         return "{}".format(self.figure_num)
 
 
 class IncludesBlock(GenericBlock):
+    __slots__ = ()
+
     def __init__(self, title, subtitle, body, origin, parent=None):
         super().__init__(title, subtitle, body, origin, parent=parent)
         if parent:
             parent.includes.extend(body)
 
     def get_file_lines(self, controller, target):
-        out = []
         if self.body:
-            out.extend(target.markdown_block([
+            yield from target.markdown_block([
                 "To use, add the following lines to the beginning of your file:"
-            ]))
-            out.extend(target.markdown_block(target.indent_lines(self.body)))
-        return out
+            ])
+            yield from target.markdown_block(target.indent_lines(self.body))
 
 
 class SectionBlock(GenericBlock):
+    __slots__ = ()
+
     def __init__(self, title, subtitle, body, origin, parent=None):
         super().__init__(title, subtitle, body, origin, parent=parent)
         if parent:
@@ -534,18 +649,16 @@ class SectionBlock(GenericBlock):
             lines.extend(target.numbered_list_end())
         for child in self.get_children_by_title(["Constant","Function","Module","Function&Module"]):
             lines.extend(child.get_toc_lines(controller, target, currfile=currfile))
-        out = []
         if self.subtitle:
             item = self.get_link(target, currfile=currfile)
-            out.extend(target.numbered_list_item(n, item))
-            out.extend(target.bullet_list_start())
-            out.extend(target.indent_lines(lines))
-            out.extend(target.bullet_list_end())
+            yield from target.numbered_list_item(n, item)
+            yield from target.bullet_list_start()
+            yield from target.indent_lines(lines)
+            yield from target.bullet_list_end()
         else:
-            out.extend(target.bullet_list_start())
-            out.extend(lines)
-            out.extend(target.bullet_list_end())
-        return out
+            yield from target.bullet_list_start()
+            yield from lines
+            yield from target.bullet_list_end()
 
     def get_cheatsheet_lines(self, controller, target):
         subs = []
@@ -574,13 +687,18 @@ class SectionBlock(GenericBlock):
         Return the markdown for this section. This includes the section
         heading and the markdown for the children.
         """
-        out = []
         if self.subtitle:
-            out.extend(target.header(str(self), lev=target.SECTION))
-            out.extend(target.markdown_block(self.get_markdown_body(controller, target)))
+            yield from target.header(str(self), lev=target.SECTION)
+            yield from target.markdown_block(self.get_markdown_body(controller, target))
         for child in self.children:
-            out.extend(child.get_file_lines(controller, target))
-        return out
+            yield from child.get_file_lines(controller, target)
+
+    def strip_to_summary(self):
+        children = self.get_children_by_title(["Subsection","Constant","Function","Module","Function&Module"])
+        super().strip_to_summary()
+        self.children = children
+        for child in self.children:
+            child.strip_to_summary()
 
     def get_figure_num(self):
         hdr = (self.parent.get_figure_num() + ".") if self.parent else ""
@@ -588,6 +706,8 @@ class SectionBlock(GenericBlock):
 
 
 class SubsectionBlock(GenericBlock):
+    __slots__ = ()
+
     def __init__(self, title, subtitle, body, origin, parent=None):
         super().__init__(title, subtitle, body, origin, parent=parent)
         if parent:
@@ -637,19 +757,17 @@ class SubsectionBlock(GenericBlock):
         lines = []
         for child in self.get_children_by_title(["Constant","Function","Module","Function&Module"]):
             lines.extend(child.get_toc_lines(controller, target, currfile=currfile))
-        out = []
         if self.subtitle:
             item = self.get_link(target, currfile=currfile)
-            out.extend(target.numbered_list_item(n, item))
+            yield from target.numbered_list_item(n, item)
             if lines:
-                out.extend(target.bullet_list_start())
-                out.extend(target.indent_lines(lines))
-                out.extend(target.bullet_list_end())
+                yield from target.bullet_list_start()
+                yield from target.indent_lines(lines)
+                yield from target.bullet_list_end()
         elif lines:
-            out.extend(target.bullet_list_start())
-            out.extend(lines)
-            out.extend(target.bullet_list_end())
-        return out
+            yield from target.bullet_list_start()
+            yield from lines
+            yield from target.bullet_list_end()
 
     def get_cheatsheet_lines(self, controller, target):
         consts = []
@@ -674,13 +792,18 @@ class SubsectionBlock(GenericBlock):
         Return the markdown for this section. This includes the section
         heading and the markdown for the children.
         """
-        out = []
         if self.subtitle:
-            out.extend(target.header(str(self), lev=target.SUBSECTION))
-            out.extend(target.markdown_block(self.get_markdown_body(controller, target)))
+            yield from target.header(str(self), lev=target.SUBSECTION)
+            yield from target.markdown_block(self.get_markdown_body(controller, target))
         for child in self.children:
-            out.extend(child.get_file_lines(controller, target))
-        return out
+            yield from child.get_file_lines(controller, target)
+
+    def strip_to_summary(self):
+        children = self.get_children_by_title(["Subsection","Constant","Function","Module","Function&Module"])
+        super().strip_to_summary()
+        self.children = children
+        for child in self.children:
+            child.strip_to_summary()
 
     def get_figure_num(self):
         hdr = (self.parent.get_figure_num() + ".") if self.parent else ""
@@ -688,6 +811,7 @@ class SubsectionBlock(GenericBlock):
 
 
 class ItemBlock(LabelBlock):
+    __slots__ = ("example_num", "deprecated", "topics", "aliases", "see_also", "synopsis", "syntags")
     _paren_pat = re.compile(r'\([^\)]+\)')
 
     def __init__(self, title, subtitle, body, origin, parent=None):
@@ -754,8 +878,12 @@ class ItemBlock(LabelBlock):
             item.body
             for item in self.children if item.title.startswith("Example")
         ]
+        d["example_images"] = [
+            item.image_url if item.shows_image() else None
+            for item in self.children if item.title.startswith("Example")
+        ]
         skip_titles = ["Alias", "Aliases", "Arguments", "Description", "See Also", "Synopsis", "SynTags", "Status", "Topics", "Usage"]
-        d["children"] = list(filter(lambda x: x["name"] not in skip_titles and not x["name"].startswith("Example"), d["children"]))
+        d["children"] = list(filter(lambda x: x["name"] not in skip_titles and not x["name"].startswith("Example"), d.get("children", [])))
         return d
 
     def get_synopsis(self, controller, target):
@@ -794,13 +922,12 @@ class ItemBlock(LabelBlock):
         return out
 
     def get_toc_lines(self, controller, target, n=1, currfile=""):
-        out = target.bullet_list_item(
+        yield from target.bullet_list_item(
             "{}{}".format(
                 self.get_link(target, currfile=currfile),
                 self.get_synopsis(controller, target),
             )
         )
-        return out
 
     def get_cheatsheet_lines(self, controller, target):
         oline = ""
@@ -851,12 +978,16 @@ class ItemBlock(LabelBlock):
             ["Example"]
         ]
         children = self.sort_children(front_blocks, back_blocks)
-        out = []
-        out.extend(target.header(str(self), lev=target.ITEM))
+        yield from target.header(str(self), lev=target.ITEM)
         for child in children:
-            out.extend(child.get_file_lines(controller, target))
-        out.extend(target.horizontal_rule())
-        return out
+            yield from child.get_file_lines(controller, target)
+        yield from target.horizontal_rule()
+
+    def strip_to_summary(self):
+        # Usage lines are still needed for the cheatsheet.
+        usages = self.get_children_by_title("Usage")
+        super().strip_to_summary()
+        self.children = usages
 
     def get_figure_num(self):
         hdr = (self.parent.get_figure_num() + ".") if self.parent else ""
@@ -864,6 +995,8 @@ class ItemBlock(LabelBlock):
 
 
 class LogBlock(GenericBlock):
+    __slots__ = ("meta", "log_output", "log_title", "script_prefix", "script_body", "log_request")
+
     def __init__(self, title, subtitle, body, origin, parent=None, meta=""):
         super().__init__(title, subtitle, body, origin, parent=parent)
         self.meta = meta
@@ -874,17 +1007,17 @@ class LogBlock(GenericBlock):
         while fileblock.parent:
             fileblock = fileblock.parent
 
-        script_lines = []
-        script_lines.extend(fileblock.includes)
-        script_lines.extend(fileblock.common_code)
-        for line in self.body:
-            if line.strip().startswith("--"):
-                script_lines.append(line.strip()[2:])
-            else:
-                script_lines.append(line)
-        self.raw_script = script_lines
+        self.script_prefix = fileblock.get_script_prefix()
+        self.script_body = tuple(
+            line.strip()[2:] if line.strip().startswith("--") else line
+            for line in self.body
+        )
         self.generate_log()
 
+    @property
+    def raw_script(self):
+        return list(self.script_prefix + self.script_body)
+
     def generate_log(self):
         self.log_request = log_manager.new_request(
             self.origin.file, self.origin.line,
@@ -895,6 +1028,9 @@ class LogBlock(GenericBlock):
         )
         log_manager.process_requests()
 
+    def get_render_jobs(self, controller, target):
+        yield RenderJob("log", self.origin.file, self.origin.line, None, self.raw_script, self.meta, self)
+
     def _log_proc_start(self, req):
         print("  Processing log for {}:{}... ".format(self.origin.file, self.origin.line), end='')
         sys.stdout.flush()
@@ -910,19 +1046,19 @@ class LogBlock(GenericBlock):
         sys.stdout.flush()
 
     def get_file_lines(self, controller, target):
-        out = []
         #if self.log_output:
         if self.log_request.success and self.log_request.echos:    
-            #out.extend(target.block_header("Log Output", ""))
-            out.extend(target.block_header(self.log_title, ""))
-            # out.extend(target.markdown_block(["```log"] + self.log_output + ["```"]))
-            out.extend(target.markdown_block(["```log"] + self.log_request.echos + ["```"]))
+            #yield from target.block_header("Log Output", "")
+            yield from target.block_header(self.log_title, "")
+            # yield from target.markdown_block(["```log"] + self.log_output + ["```"])
+            yield from target.markdown_block(["```log"] + self.log_request.echos + ["```"])
         else:
             print(f"WARNING: No log output for {self.origin.file}:{self.origin.line}")    
-        return out
 
 class ImageBlock(GenericBlock):
-    def __init__(self, title, subtitle, body, origin, verbose=False, enabled_features=[], parent=None, meta="", use_apngs=False):
+    __slots__ = ("meta", "image_url", "image_url_rel", "image_req", "script_prefix", "script_body", "verbose", "enabled_features")
+
+    def __init__(self, title, subtitle, body, origin, verbose=False, enabled_features=[], parent=None, meta="", use_apngs=False, use_webp=False):
         super().__init__(title, subtitle, body, origin, parent=parent)
         fileblock = parent
         while fileblock.parent:
@@ -933,18 +1069,16 @@ class ImageBlock(GenericBlock):
         self.image_url_rel = None
         self.image_req = None
 
-        script_lines = []
-        script_lines.extend(fileblock.includes)
-        script_lines.extend(fileblock.common_code)
-        for line in self.body:
-            if line.strip().startswith("--"):
-                script_lines.append(line.strip()[2:])
-            else:
-                script_lines.append(line)
-        self.raw_script = script_lines
+        self.script_prefix = fileblock.get_script_prefix()
+        self.script_body = tuple(
+            line.strip()[2:] if line.strip().startswith("--") else line
+            for line in self.body
+        )
 
         san_name = re.sub(r'[^A-Za-z0-9_-]', r'', os.path.basename(parent.subtitle.strip().lower().replace(" ","-")))
-        if use_apngs:
+        if use_webp and ("Spin" in self.meta or "Anim" in self.meta):
+            file_ext = "webp"
+        elif use_apngs:
             file_ext = "png"
         elif "Spin" in self.meta or "Anim" in self.meta:
             file_ext = "gif"
@@ -955,13 +1089,13 @@ class ImageBlock(GenericBlock):
             fignum = self.get_figure_num()
             figsan = fignum.replace(".","_")
             proposed_name = "figure_{}.{}".format(figsan, file_ext)
-            self.title = "{} {}".format(self.title, fignum)
+            self.title = sys.intern("{} {}".format(self.title, fignum))
         else:
             parent.example_num += 1
             image_num = parent.example_num
             img_suffix = "_{}".format(image_num) if image_num > 1 else ""
             proposed_name = "{}{}.{}".format(san_name, img_suffix, file_ext)
-            self.title = "{} {}".format(self.title, image_num)
+            self.title = sys.intern("{} {}".format(self.title, image_num))
 
         file_dir, file_name = os.path.split(fileblock.origin.file.strip())
         file_base = os.path.splitext(file_name)[0]
@@ -970,17 +1104,31 @@ class ImageBlock(GenericBlock):
         self.verbose = verbose
         self.enabled_features = enabled_features
 
-    def generate_image(self, target, parser=None):
-        self.image_req = None
+    @property
+    def raw_script(self):
+        return list(self.script_prefix + self.script_body)
+
+    def shows_image(self):
+        """Returns True if an image should be rendered for this block."""
         if "NORENDER" in self.meta:
-            return
-        show_img = (
+            return False
+        return (
             any(x in self.meta for x in ("2D", "3D", "Spin", "Anim")) or
             self.title.startswith("Figure") or
             self.parent.title in ("File", "LibFile", "Section", "Subsection", "Module", "Function&Module")
         )
-        if show_img:
-            outfile = os.path.join(target.docs_dir, self.image_url)
+
+    def get_render_jobs(self, controller, target):
+        # Hidden blocks are never rendered into the docs, so they get no image.
+        if "Hide" in self.meta or not self.shows_image():
+            return
+        outfile = os.path.join(target.images_dir, self.image_url)
+        yield RenderJob("image", self.origin.file, self.origin.line, outfile, self.raw_script, self.meta, self)
+
+    def generate_image(self, target, parser=None):
+        self.image_req = None
+        if self.shows_image():
+            outfile = os.path.join(target.images_dir, self.image_url)
             outdir = os.path.dirname(outfile)
             os.makedirs(outdir, mode=0o744, exist_ok=True)
             default_colorscheme = parser.default_colorscheme if parser else "Cornfield"
@@ -994,6 +1142,11 @@ class ImageBlock(GenericBlock):
                 default_colorscheme=default_colorscheme
             )
 
+    def get_image_urls(self):
+        """Returns the URLs of this block's image and of its scaled variants."""
+        variants = self.image_req.variants if self.image_req else []
+        return [self.image_url] + [variant_file(self.image_url, scale) for scale in variants]
+
     def get_data(self):
         d = super().get_data()
         d["script"] = self.raw_script
@@ -1001,10 +1154,21 @@ class ImageBlock(GenericBlock):
         return d
 
     def _img_proc_start(self, req):
-        print("  {}... ".format(os.path.basename(self.image_url)), end='')
+        # Batched images finish after others start, so their results get their own lines.
+        if req.batched:
+            print("  {}...".format(os.path.basename(self.image_url)))
+        else:
+            print("  {}... ".format(os.path.basename(self.image_url)), end='')
         sys.stdout.flush()
 
     def _img_proc_done(self, req):
+        if req.success and req.batched:
+            print("  {}... {}".format(
+                os.path.basename(self.image_url),
+                "UNCHANGED" if req.status == "SKIP" else req.status
+            ))
+            sys.stdout.flush()
+            return
         if req.success:
             if req.status == "SKIP":
                 print()
@@ -1033,11 +1197,8 @@ class ImageBlock(GenericBlock):
         fileblock = self.parent
         while fileblock.parent:
             fileblock = fileblock.parent
-        out = []
         if "Hide" in self.meta:
-            return out
-
-        self.generate_image(target, controller)
+            return
 
         code = []
         code.extend([line for line in fileblock.includes])
@@ -1051,29 +1212,39 @@ class ImageBlock(GenericBlock):
         code_below = False
         width = ''
         height = ''
+        srcset = []
+        rel_url = target.image_url(self.image_url_rel, os.path.dirname(self.origin.file.strip()))
         if self.image_req:
             code_below = self.image_req.script_under
             width = int(self.image_req.imgsize[0])
             height = int(self.image_req.imgsize[1])
+            # Smaller variants are thumbnails, not alternatives for the page.
+            srcset = [
+                (variant_file(rel_url, scale), scale)
+                for scale in self.image_req.variants if scale > 1
+            ]
         sub = self.parse_links(self.subtitle, controller, target)
         sub = target.escape_entities(sub)
         if "Figure" in self.title:
-            out.extend(target.image_block(self.parent.subtitle, self.title, sub, rel_url=self.image_url_rel, code_below=code_below, width=width, height=height))
+            yield from target.image_block(self.parent.subtitle, self.title, sub, rel_url=rel_url, code_below=code_below, width=width, height=height, srcset=srcset)
         elif not do_render:
-            out.extend(target.image_block(self.parent.subtitle, self.title, sub, code=code, code_below=code_below, width=width, height=height))
+            yield from target.image_block(self.parent.subtitle, self.title, sub, code=code, code_below=code_below, width=width, height=height)
         else:
-            out.extend(target.image_block(self.parent.subtitle, self.title, sub, code=code, rel_url=self.image_url_rel, code_below=code_below, width=width, height=height))
-        return out
+            yield from target.image_block(self.parent.subtitle, self.title, sub, code=code, rel_url=rel_url, code_below=code_below, width=width, height=height, srcset=srcset)
 
 
 class FigureBlock(ImageBlock):
-    def __init__(self, title, subtitle, body, origin, parent, verbose=False, enabled_features=[], meta="", use_apngs=False):
-        super().__init__(title, subtitle, body, origin, verbose=verbose, enabled_features=enabled_features, parent=parent, meta=meta, use_apngs=use_apngs)
+    __slots__ = ()
+
+    def __init__(self, title, subtitle, body, origin, parent, verbose=False, enabled_features=[], meta="", use_apngs=False, use_webp=False):
+        super().__init__(title, subtitle, body, origin, verbose=verbose, enabled_features=enabled_features, parent=parent, meta=meta, use_apngs=use_apngs, use_webp=use_webp)
 
 
 class ExampleBlock(ImageBlock):
-    def __init__(self, title, subtitle, body, origin, parent, verbose=False, enabled_features=[], meta="", use_apngs=False):
-        super().__init__(title, subtitle, body, origin, verbose=verbose, enabled_features=enabled_features, parent=parent, meta=meta, use_apngs=use_apngs)
+    __slots__ = ()
+
+    def __init__(self, title, subtitle, body, origin, parent, verbose=False, enabled_features=[], meta="", use_apngs=False, use_webp=False):
+        super().__init__(title, subtitle, body, origin, verbose=verbose, enabled_features=enabled_features, parent=parent, meta=meta, use_apngs=use_apngs, use_webp=use_webp)
 
 
 
@@ -0,0 +1,70 @@
+from __future__ import print_function
+
+import os
+import os.path
+import sys
+import json
+
+from .filehashes import sha256sum
+
+
+class DocsCache(object):
+    """Remembers, for each generated docs file, the key it was generated
+    with, the digest of its contents, and the link targets it used.
+    """
+    def __init__(self, cachefile):
+        self.cachefile = cachefile
+        self.load()
+
+    def load(self):
+        """Reads all cache entries from the cache file.
+        """
+        self.entries = {}
+        if os.path.isfile(self.cachefile):
+            try:
+                with open(self.cachefile, "r") as f:
+                    self.entries = json.load(f)
+            except ValueError as e:
+                print("Corrupt docs cache file.  Ignoring.", file=sys.stderr)
+                sys.stderr.flush()
+                self.entries = {}
+
+    def save(self):
+        """Writes out all cache entries.
+        """
+        os.makedirs(os.path.dirname(self.cachefile), exist_ok=True)
+        with open(self.cachefile, "w") as f:
+            json.dump(self.entries, f, sort_keys=True, indent=1)
+
+    def get_link_targets(self, outfile):
+        """Returns the link targets recorded the last time the given file was generated.
+        """
+        entry = self.entries.get(outfile)
+        return entry["targets"] if entry else []
+
+    def is_current(self, outfile, key):
+        """Returns True if the given file was generated with the given key,
+        and has not been changed since.
+        """
+        entry = self.entries.get(outfile)
+        if not entry or entry["key"] != key:
+            return False
+        return os.path.isfile(outfile) and sha256sum(outfile) == entry["digest"]
+
+    def update(self, outfile, key, link_targets):
+        """Records the key and link targets the given file was just generated with.
+        """
+        self.entries[outfile] = {
+            "key": key,
+            "digest": sha256sum(outfile),
+            "targets": sorted(link_targets),
+        }
+
+    def invalidate(self, outfile):
+        """Forgets the cache entry for the given file.
+        """
+        self.entries.pop(outfile, None)
+
+
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 nowrap
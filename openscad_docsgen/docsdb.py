@@ -0,0 +1,216 @@
+from __future__ import print_function
+
+import os
+import os.path
+import re
+import sqlite3
+
+
+class DocsDatabase(object):
+    """Writes the parsed documentation tree out as an indexed SQLite database,
+    for tools that want to query the docs without parsing markdown.
+
+    The data comes from the `get_data()` results of each file block.  All
+    rows are bulk-inserted in a single transaction into a temporary file,
+    which then replaces the output file.
+    """
+    SCHEMA_VERSION = 1
+    SCHEMA = """
+        CREATE TABLE meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE TABLE files (
+            id INTEGER PRIMARY KEY,
+            kind TEXT NOT NULL,
+            path TEXT NOT NULL,
+            grp TEXT,
+            summary TEXT,
+            body TEXT,
+            includes TEXT,
+            commoncode TEXT
+        );
+        CREATE TABLE sections (
+            id INTEGER PRIMARY KEY,
+            file_id INTEGER NOT NULL REFERENCES files(id),
+            parent_id INTEGER REFERENCES sections(id),
+            kind TEXT NOT NULL,
+            title TEXT,
+            body TEXT,
+            line INTEGER
+        );
+        CREATE TABLE items (
+            id INTEGER PRIMARY KEY,
+            file_id INTEGER NOT NULL REFERENCES files(id),
+            section_id INTEGER REFERENCES sections(id),
+            kind TEXT NOT NULL,
+            name TEXT NOT NULL,
+            subtitle TEXT,
+            synopsis TEXT,
+            deprecated INTEGER NOT NULL,
+            description TEXT,
+            line INTEGER
+        );
+        CREATE TABLE aliases (
+            item_id INTEGER NOT NULL REFERENCES items(id),
+            alias TEXT NOT NULL
+        );
+        CREATE TABLE topics (
+            item_id INTEGER NOT NULL REFERENCES items(id),
+            topic TEXT NOT NULL
+        );
+        CREATE TABLE syntags (
+            item_id INTEGER NOT NULL REFERENCES items(id),
+            tag TEXT NOT NULL,
+            description TEXT
+        );
+        CREATE TABLE see_also (
+            item_id INTEGER NOT NULL REFERENCES items(id),
+            name TEXT NOT NULL
+        );
+        CREATE TABLE usages (
+            item_id INTEGER NOT NULL REFERENCES items(id),
+            seq INTEGER NOT NULL,
+            subtitle TEXT,
+            line TEXT NOT NULL
+        );
+        CREATE TABLE arguments (
+            item_id INTEGER NOT NULL REFERENCES items(id),
+            seq INTEGER NOT NULL,
+            positional INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            description TEXT
+        );
+        CREATE TABLE examples (
+            item_id INTEGER NOT NULL REFERENCES items(id),
+            seq INTEGER NOT NULL,
+            script TEXT,
+            image_url TEXT
+        );
+        CREATE TABLE definitions (
+            term TEXT NOT NULL,
+            main_term TEXT NOT NULL,
+            definition TEXT
+        );
+        CREATE INDEX items_name ON items(name);
+        CREATE INDEX items_file ON items(file_id);
+        CREATE INDEX aliases_alias ON aliases(alias);
+        CREATE INDEX topics_topic ON topics(topic);
+        CREATE INDEX syntags_tag ON syntags(tag);
+        CREATE INDEX usages_item ON usages(item_id);
+        CREATE INDEX arguments_name ON arguments(name);
+        CREATE INDEX arguments_item ON arguments(item_id);
+        CREATE INDEX examples_item ON examples(item_id);
+        CREATE INDEX definitions_term ON definitions(term);
+    """
+    _item_titles = ("Constant", "Function", "Module", "Function&Module")
+
+    def __init__(self):
+        self.rows = {
+            "files": [], "sections": [], "items": [],
+            "aliases": [], "topics": [], "syntags": [], "see_also": [],
+            "usages": [], "arguments": [], "examples": [], "definitions": [],
+        }
+
+    @staticmethod
+    def _text(lines):
+        return "\n".join(lines)
+
+    @staticmethod
+    def _item_name(subtitle):
+        return re.sub(r'\(.*$', '', subtitle).strip()
+
+    @staticmethod
+    def _arg_names(names):
+        """Splits an Arguments table name cell, like `h / l / height`, or `a, b`,
+        into the separate argument names it documents.
+        """
+        return [name.strip() for name in re.split(r'[/,]', names) if name.strip()]
+
+    def add_file(self, data):
+        """Adds the rows for the given file data, as returned by FileBlock.get_data()."""
+        file_id = len(self.rows["files"]) + 1
+        self.rows["files"].append((
+            file_id, data["name"], data["subtitle"], data["group"], data["summary"],
+            self._text(data["body"]), self._text(data["includes"]), self._text(data["commoncode"]),
+        ))
+        self._add_children(file_id, None, data.get("children", []))
+
+    def _add_children(self, file_id, section_id, children):
+        for child in children:
+            if child["name"] in ("Section", "Subsection"):
+                sect_id = len(self.rows["sections"]) + 1
+                self.rows["sections"].append((
+                    sect_id, file_id, section_id, child["name"], child["subtitle"],
+                    self._text(child["body"]), child["line"],
+                ))
+                self._add_children(file_id, sect_id, child.get("children", []))
+            elif child["name"] in self._item_titles:
+                self._add_item(file_id, section_id, child)
+
+    def _add_item(self, file_id, section_id, data):
+        item_id = len(self.rows["items"]) + 1
+        self.rows["items"].append((
+            item_id, file_id, section_id, data["name"], self._item_name(data["subtitle"]),
+            data["subtitle"], data["synopsis"], 1 if data.get("deprecated") else 0,
+            self._text(data["description"]), data["line"],
+        ))
+        self.rows["aliases"].extend((item_id, self._item_name(alias)) for alias in data["aliases"])
+        self.rows["topics"].extend((item_id, topic) for topic in data["topics"])
+        self.rows["syntags"].extend((item_id, tag, desc) for tag, desc in sorted(data["syntags"].items()))
+        self.rows["see_also"].extend((item_id, self._item_name(name)) for name in data["see_also"])
+        self.rows["usages"].extend(
+            (item_id, seq, usage["subtitle"], line)
+            for seq, usage in enumerate(data["usages"])
+            for line in usage["body"]
+        )
+        positional = 1
+        for seq, line in enumerate(data["arguments"]):
+            if line == "---":
+                positional = 0
+                continue
+            names, _, desc = line.partition("=")
+            self.rows["arguments"].extend(
+                (item_id, seq, positional, name, desc.strip())
+                for name in self._arg_names(names)
+            )
+        self.rows["examples"].extend(
+            (item_id, seq, self._text(script), image)
+            for seq, (script, image) in enumerate(zip(data["examples"], data["example_images"]))
+        )
+
+    def add_definitions(self, definitions):
+        """Adds the glossary definitions, as stored in the parser's definitions dictionary."""
+        for key, (terms, defn) in sorted(definitions.items()):
+            self.rows["definitions"].extend((term, terms[0], defn) for term in terms)
+
+    def write(self, outfile, project_name=None):
+        """Writes all added rows to the given SQLite database file."""
+        outdir, outname = os.path.split(outfile)
+        tmpfile = os.path.join(outdir, ".{}.{}.tmp".format(outname, os.getpid()))
+        if os.path.exists(tmpfile):
+            os.unlink(tmpfile)
+        try:
+            conn = sqlite3.connect(tmpfile)
+            try:
+                conn.executescript(self.SCHEMA)
+                with conn:
+                    conn.executemany(
+                        "INSERT INTO meta VALUES (?, ?)",
+                        [("schema_version", str(self.SCHEMA_VERSION)), ("project_name", project_name)]
+                    )
+                    for table, rows in self.rows.items():
+                        if rows:
+                            conn.executemany(
+                                "INSERT INTO {} VALUES ({})".format(table, ", ".join("?" * len(rows[0]))),
+                                rows
+                            )
+            finally:
+                conn.close()
+            os.replace(tmpfile, outfile)
+        finally:
+            if os.path.exists(tmpfile):
+                os.unlink(tmpfile)
+
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 nowrap
@@ -23,6 +23,14 @@ class ErrorLog(object):
         if level == self.FAIL:
             self.has_errors = True
 
+    def merge_entries(self, entries):
+        """Records entries that were already reported by a worker process."""
+        for file, line, msg, level in entries:
+            self.errlist.append( (file, line, msg, level) )
+            self.badfiles[file] = 1
+            if level == self.FAIL:
+                self.has_errors = True
+
     def write_report(self):
         report = [
             {
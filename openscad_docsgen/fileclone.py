@@ -0,0 +1,80 @@
+from __future__ import print_function
+
+import os
+import os.path
+import shutil
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# The Linux FICLONE ioctl, which makes a copy-on-write clone of a file.
+FICLONE = 0x40049409
+
+
+def _reflink(src_file, dst_file):
+    """Tries to make `dst_file` a copy-on-write clone of `src_file`.
+    Returns True if it worked.
+    """
+    if fcntl is None:
+        return False
+    with open(src_file, "rb") as src, open(dst_file, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return True
+        except OSError:
+            return False
+
+
+def _copy_in_kernel(src_file, dst_file):
+    """Copies `src_file` to `dst_file` without passing the data through
+    user space, if `os.copy_file_range()` is available.  Returns True if it
+    worked.
+    """
+    if not hasattr(os, "copy_file_range"):
+        return False
+    with open(src_file, "rb") as src, open(dst_file, "wb") as dst:
+        remaining = os.fstat(src.fileno()).st_size
+        try:
+            while remaining > 0:
+                copied = os.copy_file_range(src.fileno(), dst.fileno(), remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+        except OSError:
+            return False
+        return remaining == 0
+
+
+def clone_file(src_file, dst_file, hardlink=True):
+    """Puts a file with the contents of `src_file` at `dst_file`, using as
+    little I/O as the filesystem allows.  In order, it tries a hard link,
+    if `hardlink` is true, then a copy-on-write reflink, then an in-kernel
+    copy, then a regular copy, which uses `sendfile()` where it can.
+
+    Any old `dst_file` is replaced, never written through, so other files
+    sharing its inode are left unchanged.  `src_file` is never modified.
+    """
+    outdir, outname = os.path.split(dst_file)
+    tmpfile = os.path.join(outdir, ".{}.{}.tmp".format(outname, os.getpid()))
+    if os.path.exists(tmpfile):
+        os.unlink(tmpfile)
+    try:
+        linked = False
+        if hardlink:
+            try:
+                os.link(src_file, tmpfile)
+                linked = True
+            except OSError:
+                pass
+        if not linked and not _reflink(src_file, tmpfile) and not _copy_in_kernel(src_file, tmpfile):
+            shutil.copyfile(src_file, tmpfile)
+        os.replace(tmpfile, dst_file)
+    finally:
+        if os.path.exists(tmpfile):
+            os.unlink(tmpfile)
+
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 nowrap
@@ -5,6 +5,22 @@ import os.path
 import sys
 import hashlib
 
+
+def sha256sum(filename):
+    """Calculate the hash value for the given file's contents.
+    """
+    h = hashlib.sha256()
+    b = bytearray(128*1024)
+    mv = memoryview(b)
+    try:
+        with open(filename, 'rb', buffering=0) as f:
+            for n in iter(lambda : f.readinto(mv), 0):
+                h.update(mv[:n])
+    except FileNotFoundError as e:
+        pass
+    return h.hexdigest()
+
+
 class FileHashes(object):
     def __init__(self, hashfile):
         self.hashfile = hashfile
@@ -13,16 +29,7 @@ class FileHashes(object):
     def _sha256sum(self, filename):
         """Calculate the hash value for the given file's contents.
         """
-        h = hashlib.sha256()
-        b = bytearray(128*1024)
-        mv = memoryview(b)
-        try:
-            with open(filename, 'rb', buffering=0) as f:
-                for n in iter(lambda : f.readinto(mv), 0):
-                    h.update(mv[:n])
-        except FileNotFoundError as e:
-            pass
-        return h.hexdigest()
+        return sha256sum(filename)
 
     def load(self):
         """Reads all known file hash values from the hashes file.
@@ -0,0 +1,127 @@
+from __future__ import print_function
+
+import os
+import os.path
+import sys
+import json
+import hashlib
+
+from imageio import imread
+
+from .filehashes import sha256sum
+
+
+class ImageDigests(object):
+    """Remembers the byte digest, dimensions, and decoded pixel digest of each
+    installed image, so that a new render can usually be compared against it
+    without decoding the installed image again.
+
+    An entry is only trusted while the image's size and modification time
+    are the same as when it was recorded.
+    """
+    def __init__(self, digests_file):
+        self.digests_file = digests_file
+        self.load()
+
+    def load(self):
+        """Reads the image digests file.
+        """
+        self.entries = {}
+        self.dirty = False
+        if os.path.isfile(self.digests_file):
+            try:
+                with open(self.digests_file, "r") as f:
+                    self.entries = json.load(f)["images"]
+            except (ValueError, KeyError, TypeError) as e:
+                print("Corrupt image digests file.  Ignoring.", file=sys.stderr)
+                sys.stderr.flush()
+                self.entries = {}
+
+    def save(self):
+        """Writes out the image digests file, if anything changed.
+        """
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.digests_file), exist_ok=True)
+        with open(self.digests_file, "w") as f:
+            json.dump({"images": self.entries}, f, sort_keys=True, indent=1)
+        self.dirty = False
+
+    @staticmethod
+    def _has_pixels(filename):
+        # GIFs and WebPs are only ever compared byte for byte.
+        return not filename.endswith((".gif", ".webp"))
+
+    @staticmethod
+    def pixel_digest(filename):
+        """Decodes the given image, and returns its dimensions, and the digest
+        of its pixel data.
+        """
+        img = imread(filename)
+        h = hashlib.sha256()
+        h.update(str(img.shape).encode("utf-8"))
+        h.update(img.tobytes())
+        return list(img.shape), h.hexdigest()
+
+    def get(self, filename):
+        """Returns the recorded entry for the given image, or None if there
+        isn't one, or if the image changed since it was recorded.
+        """
+        entry = self.entries.get(filename)
+        if entry is None or not os.path.isfile(filename):
+            return None
+        st = os.stat(filename)
+        if entry.get("size") != st.st_size or entry.get("mtime") != st.st_mtime:
+            return None
+        return entry
+
+    def compare(self, filename, new_file):
+        """Compares the new image file against the recorded entry for the
+        given installed image.  Returns a tuple of the result, and the
+        digests worked out for `new_file`.  The result is True if the images
+        are the same, False if they differ, or None if only a full pixel
+        comparison can tell.
+        """
+        info = {"digest": sha256sum(new_file)}
+        entry = self.get(filename)
+        if entry is None:
+            return None, info
+        if info["digest"] == entry["digest"]:
+            return True, info
+        if not self._has_pixels(filename):
+            return False, info
+        if "pixels" not in entry:
+            return None, info
+        info["shape"], info["pixels"] = self.pixel_digest(new_file)
+        if info["pixels"] == entry["pixels"]:
+            return True, info
+        if info["shape"] != entry["shape"]:
+            return False, info
+        return None, info
+
+    def update(self, filename, info=None):
+        """Records the entry for the given installed image.  Any digests in
+        `info` that were already worked out for it are used as they are.
+        """
+        entry = dict(info or {})
+        if "digest" not in entry:
+            entry["digest"] = sha256sum(filename)
+        if self._has_pixels(filename) and "pixels" not in entry:
+            entry["shape"], entry["pixels"] = self.pixel_digest(filename)
+        st = os.stat(filename)
+        entry["size"] = st.st_size
+        entry["mtime"] = st.st_mtime
+        self.entries[filename] = entry
+        self.dirty = True
+
+    def get_pixels(self, filename):
+        """Returns just the dimensions and pixel digest recorded for the given
+        image, for re-recording it after a lossless rewrite.
+        """
+        entry = self.get(filename)
+        if entry is None or "pixels" not in entry:
+            return None
+        return {"shape": entry["shape"], "pixels": entry["pixels"]}
+
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 nowrap
@@ -7,9 +7,14 @@ import re
 import sys
 import math
 import numpy
+import atexit
+import shutil
 import filecmp
+import hashlib
 import os.path
+import tempfile
 import subprocess
+import multiprocessing
 from collections import namedtuple
 
 from scipy.linalg import norm
@@ -17,8 +22,24 @@ from imageio import imread
 from PIL import Image, ImageChops
 from openscad_runner import RenderMode, OpenScadRunner, ColorScheme
 
+from .animencoder import encode_animation
+from .pngoptimizer import optimize_png
+from .imagevariants import variant_file, make_variants
+from .fileclone import clone_file
+from .svgraster import COLOR_SCHEMES, rasterize_svg
+
 
 class ImageRequest(object):
+    __slots__ = (
+        "src_file", "src_line", "image_file", "image_meta", "enabled_features",
+        "script_lines", "completion_cb", "starting_cb", "verbose",
+        "render_mode", "imgsize", "camera", "animation_frames", "frame_ms",
+        "show_edges", "show_axes", "show_scales", "orthographic",
+        "script_under", "color_scheme", "variants", "variant_status",
+        "vp_script_lines", "plain_geometry", "static_geometry", "batched",
+        "complete", "status", "success", "cmdline", "return_code",
+        "stdout", "stderr", "echos", "warnings", "errors",
+    )
     _size_re = re.compile(r'Size *= *([0-9]+) *x *([0-9]+)')
     _frames_re = re.compile(r'Frames *= *([0-9]+)')
     _framems_re = re.compile(r'FrameMS *= *([0-9]+)')
@@ -28,6 +49,9 @@ class ImageRequest(object):
     _vpd_re = re.compile(r'VPD *= *([a-zA-Z0-9_()+*/$.-]+)')
     _vpf_re = re.compile(r'VPF *= *([a-zA-Z0-9_()+*/$.-]+)')
     _color_scheme_re = re.compile(r'ColorScheme *= *([a-zA-Z0-9_ ]+)')
+    _dynamic_var_re = re.compile(r'\$(t|vp[a-z]+)\b')
+    # Highlighted and background geometry, and colors, don't survive a mesh or SVG export.
+    _unmeshable_re = re.compile(r'[%#]|\bcolor *\(')
 
     def __init__(self, src_file, src_line, image_file, script_lines, image_meta, starting_cb=None, completion_cb=None, verbose=False, enabled_features=[], default_colorscheme="Cornfield"):
         self.src_file = src_file
@@ -54,6 +78,20 @@ class ImageRequest(object):
         self.orthographic = "Perspective" not in image_meta
         self.script_under = False
         self.color_scheme = default_colorscheme 
+        self.variants = []
+        self.variant_status = {}
+        # Set when the request is rendered as part of a batch, so that other
+        # requests start before it finishes.
+        self.batched = False
+        self.vp_script_lines = []
+        # The geometry can be shown from a mesh or SVG export if it has no
+        # modifiers or colors, and can't change between frames if the script
+        # never looks at the animation time or at the camera.  Library code
+        # the script includes isn't checked, so these are only used on request.
+        self.plain_geometry = not any(self._unmeshable_re.search(line) for line in self.script_lines)
+        self.static_geometry = self.plain_geometry and not any(
+            self._dynamic_var_re.search(line) for line in self.script_lines
+        )
 
         if "ThrownTogether" in image_meta:
             self.render_mode = RenderMode.thrown_together
@@ -118,12 +156,13 @@ class ImageRequest(object):
 
         if dynamic_vp:
             self.camera = None
-            self.script_lines[0:0] = [
+            self.vp_script_lines = [
                 "$vpt = [{}, {}, {}];".format(*vpt),
                 "$vpr = [{}, {}, {}];".format(*vpr),
                 "$vpd = {};".format(vpd),
                 "$vpf = {};".format(vpf),
             ]
+            self.script_lines[0:0] = self.vp_script_lines
         else:
             self.camera = [vpt[0],vpt[1],vpt[2], vpr[0],vpr[1],vpr[2], vpd]
 
@@ -201,6 +240,23 @@ class ImageManager(object):
     def __init__(self):
         self.requests = []
         self.test_only = False
+        self.jobs = 1
+        self.optimize_animations = False
+        self.anim_count = 0
+        self.anim_bytes_before = 0
+        self.anim_bytes_after = 0
+        self.optimize_pngs = False
+        self.image_variants = []
+        self.image_digests = None
+        self._scratch_dir = None
+        self._pool = None
+        self.rasterize_2d = False
+        self.mesh_spins = False
+        self._rasters = {}
+        self.optimized_hashes = None
+        self.png_count = 0
+        self.png_bytes_before = 0
+        self.png_bytes_after = 0
 
     def purge_requests(self):
         self.requests = []
@@ -209,48 +265,314 @@ class ImageManager(object):
         if "NORENDER" in image_meta:
             raise Exception("Cannot render scripts marked NORENDER")
         req = ImageRequest(src_file, src_line, image_file, script_lines, image_meta, starting_cb, completion_cb, verbose=verbose, enabled_features=enabled_features, default_colorscheme=default_colorscheme)
+        if not req.animation_frames:
+            req.variants = list(self.image_variants)
         self.requests.append(req)
         return req
 
     def process_requests(self, test_only=False):
         self.test_only = test_only
-        for req in self.requests:
-            self.process_request(req)
+        staged = [
+            req for req in self.requests
+            if self._rasterizes(req) or self._encodes(req) or self._varies(req)
+        ]
+        if self.jobs > 1 and len(staged) > 1:
+            self._process_requests_pooled()
+        else:
+            for req in self.requests:
+                self.process_request(req)
+        if self.optimize_pngs and not test_only:
+            self._optimize_pngs(self.requests)
+        if self.image_digests:
+            self.image_digests.save()
         self.requests = []
 
+    def _optimize_pngs(self, reqs):
+        """Losslessly recompresses the still PNG images installed by the given
+        requests.  The digest of each optimized file is remembered, so images
+        that haven't changed since they were last optimized are left alone."""
+        hashes = self.optimized_hashes
+        files = sorted(set(
+            filename for req in reqs
+            if req.success and req.status in ("NEW", "REPLACE", "SKIP")
+            and not req.animation_frames and req.image_file.endswith(".png")
+            for filename in [req.image_file] + list(req.variant_status)
+        ))
+        if hashes:
+            files = [f for f in files if hashes.is_changed(f)]
+        if not files:
+            return
+        # Optimizing is lossless, so the recorded pixels stay the same.
+        pixels = {}
+        if self.image_digests:
+            pixels = {f: self.image_digests.get_pixels(f) for f in files}
+        if self.jobs > 1 and len(files) > 1:
+            results = self._get_pool().map(optimize_png, files)
+        else:
+            results = [optimize_png(f) for f in files]
+        for filename, sizes in zip(files, results):
+            self.png_count += 1
+            self.png_bytes_before += sizes[0]
+            self.png_bytes_after += sizes[1]
+            if hashes:
+                hashes.is_changed(filename)
+            if self.image_digests:
+                self.image_digests.update(filename, pixels[filename])
+        if hashes:
+            hashes.save()
+
+    def _encodes(self, req):
+        """Returns True if the given request's rendered animation goes through the encoding stage."""
+        if self.test_only or not req.animation_frames:
+            return False
+        return self.optimize_animations or req.image_file.endswith(".webp")
+
+    def _varies(self, req):
+        """Returns True if scaled variants are made of the given request's rendered image."""
+        return not self.test_only and bool(req.variants)
+
+    def _render_size(self, req):
+        """Returns the size to render the given request's image at.  When
+        variants larger than the image are wanted, it is rendered at the
+        largest of their sizes, and scaled down from there."""
+        if not self._varies(req):
+            return req.imgsize
+        scale = max([1.0] + req.variants)
+        return [scale * x for x in req.imgsize]
+
+    @property
+    def scratch_dir(self):
+        """The private directory that images are rendered and processed in,
+        before the final image is installed.  It is made on first use, in
+        shared memory if the system has it, and removed on exit."""
+        if self._scratch_dir is None:
+            shm_dir = "/dev/shm"
+            tmp_dir = shm_dir if os.path.isdir(shm_dir) and os.access(shm_dir, os.W_OK) else None
+            self._scratch_dir = tempfile.mkdtemp(prefix="openscad_docsgen_", dir=tmp_dir)
+            atexit.register(shutil.rmtree, self._scratch_dir, True)
+        return self._scratch_dir
+
+    def _rendered_file(self, req):
+        """Returns the temporary files that OpenSCAD renders the given request to,
+        and that the encoding stage writes the final image to.  They are named
+        for the image's directory as well as its name, so that images with the
+        same name in different directories never share them."""
+        image_dir, base_name = os.path.split(os.path.abspath(req.image_file))
+        file_base, file_ext = os.path.splitext(base_name)
+        dir_hash = hashlib.sha256(image_dir.encode("utf-8")).hexdigest()[:12]
+        file_base = "{0}_{1}".format(dir_hash, file_base)
+        new_img_file = os.path.join(self.scratch_dir, "{0}{1}".format(file_base, file_ext))
+        if file_ext == ".webp":
+            # OpenSCAD can only animate to GIFs or PNGs.
+            return os.path.join(self.scratch_dir, "{0}_frames.png".format(file_base)), new_img_file
+        return new_img_file, new_img_file
+
+    def _note_encoding(self, sizes):
+        self.anim_count += 1
+        self.anim_bytes_before += sizes[0]
+        self.anim_bytes_after += sizes[1]
+
+    def _get_pool(self):
+        """Returns the pool of worker processes for image processing.  It is
+        started on first use, and shared by every batch of requests."""
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.jobs)
+            atexit.register(self.close_pool)
+        return self._pool
+
+    def close_pool(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def _process_requests_pooled(self):
+        """Renders all requests, then encodes their animations and makes
+        their image variants in a pool of worker processes, then compares
+        and installs the results.  Each request is started as it's rendered,
+        and completed once the whole batch has been processed."""
+        rendered = []
+        for req in self.requests:
+            req.batched = True
+            req.starting()
+            rendered.append((req, self._render_request(req)))
+        rasters = [(req, self._rasters.pop(req)) for req, osc in rendered if req in self._rasters]
+        if rasters:
+            drawn = self._get_pool().starmap(self._rasterize, [args for req, args in rasters])
+            failed = set(req for (req, args), ok in zip(rasters, drawn) if not ok)
+            rendered = [
+                (req, self._render_gl(req) if req in failed else osc)
+                for req, osc in rendered
+            ]
+        encodes = [
+            (req, self._rendered_file(req))
+            for req, osc in rendered
+            if self._render_ok(osc) and self._encodes(req)
+        ]
+        varies = [
+            (self._rendered_file(req)[1], req.imgsize, req.variants)
+            for req, osc in rendered
+            if self._render_ok(osc) and self._varies(req)
+        ]
+        results = []
+        if encodes:
+            results = self._get_pool().starmap(
+                encode_animation,
+                [(render_file, new_img_file, req.frame_ms) for req, (render_file, new_img_file) in encodes]
+            )
+        if varies:
+            self._get_pool().starmap(make_variants, varies)
+        for (req, (render_file, new_img_file)), sizes in zip(encodes, results):
+            if render_file != new_img_file:
+                os.unlink(render_file)
+            self._note_encoding(sizes)
+        for req, osc in rendered:
+            self._finish_request(req, osc)
+
     def process_request(self, req):
         req.starting()
+        osc = self._render_request(req)
+        if req in self._rasters and not self._rasterize(*self._rasters.pop(req)):
+            osc = self._render_gl(req)
+        if self._render_ok(osc) and self._encodes(req):
+            render_file, new_img_file = self._rendered_file(req)
+            self._note_encoding(encode_animation(render_file, new_img_file, req.frame_ms))
+            if render_file != new_img_file:
+                os.unlink(render_file)
+        if self._render_ok(osc) and self._varies(req):
+            make_variants(self._rendered_file(req)[1], req.imgsize, req.variants)
+        self._finish_request(req, osc)
 
-        dir_name = os.path.dirname(req.image_file)
-        base_name = os.path.basename(req.image_file)
-        file_base, file_ext = os.path.splitext(base_name)
-        script_file = "tmp_{0}.scad".format(base_name.replace(".", "_"))
-        targ_img_file = req.image_file
-        new_img_file = "tmp_{0}{1}".format(file_base, file_ext)
+    @staticmethod
+    def _render_ok(osc):
+        return osc.good() and not osc.warnings and not osc.errors
+
+    def _render_request(self, req):
+        """Runs OpenSCAD to render the given request to a temporary image file."""
+        render_file, new_img_file = self._rendered_file(req)
+        if self._rasterizes(req):
+            osc = self._export_svg(req, render_file)
+            if osc:
+                return osc
+        if self._spins_mesh(req):
+            osc = self._render_mesh_spin(req, render_file)
+            if osc:
+                return osc
+        return self._run_openscad(req, req.script_lines, render_file, req.animation_frames)
+
+    def _rasterizes(self, req):
+        """Returns True if the given request is a still 2D image that can be
+        drawn from an SVG export, without OpenSCAD's OpenGL renderer."""
+        return bool(
+            self.rasterize_2d and not self.test_only and "2D" in req.image_meta and
+            not req.animation_frames and not req.vp_script_lines and
+            not any("$vp" in line for line in req.script_lines) and
+            req.plain_geometry and req.color_scheme in COLOR_SCHEMES
+        )
+
+    def _export_svg(self, req, render_file):
+        """Exports the 2D geometry of the given request to an SVG file, and
+        queues drawing it to the request's image.  Returns None if the
+        geometry can't be exported, so that the request can be rendered
+        the usual way."""
+        svg_file = os.path.splitext(render_file)[0] + ".svg"
+        try:
+            osc = self._run_openscad(req, req.script_lines, svg_file, None, export=True)
+        except Exception:
+            osc = None
+        if osc is None or not self._render_ok(osc) or not os.path.isfile(svg_file):
+            if os.path.exists(svg_file):
+                os.unlink(svg_file)
+            return None
+        self._rasters[req] = (
+            svg_file, render_file, self._render_size(req),
+            req.color_scheme, req.show_axes, req.show_scales,
+        )
+        return osc
 
-        with open(script_file, "w") as f:
-            for line in req.script_lines:
+    @staticmethod
+    def _rasterize(svg_file, render_file, imgsize, color_scheme, show_axes, show_scales):
+        """Draws an exported SVG file to the image file.  Returns False if it
+        couldn't be drawn."""
+        try:
+            rasterize_svg(svg_file, render_file, imgsize, color_scheme, show_axes, show_scales)
+            return True
+        except Exception:
+            return False
+        finally:
+            os.unlink(svg_file)
+
+    def _render_gl(self, req):
+        """Renders the given request with OpenSCAD, after its image couldn't
+        be drawn from its SVG export."""
+        return self._run_openscad(req, req.script_lines, self._rendered_file(req)[0], req.animation_frames)
+
+    def _spins_mesh(self, req):
+        """Returns True if the given request is a Render mode animation where
+        only the camera moves, so its geometry only needs rendering once."""
+        return bool(
+            self.mesh_spins and not self.test_only and
+            req.animation_frames and req.vp_script_lines and
+            req.static_geometry and req.render_mode == RenderMode.render and
+            not req.show_edges
+        )
+
+    def _render_mesh_spin(self, req, render_file):
+        """Renders the geometry of the given request once, to a mesh file, then
+        renders each animation frame from a script that just imports that mesh.
+        Returns None if the geometry can't be exported as a mesh, or the frames
+        can't be rendered from it, so that the request can be rendered the
+        usual way."""
+        mesh_file = os.path.splitext(render_file)[0] + ".off"
+        try:
+            mesh_osc = self._run_openscad(req, req.script_lines, mesh_file, None, export=True)
+            if not self._render_ok(mesh_osc) or not os.path.isfile(mesh_file):
+                return None
+            import_line = 'import("{}");'.format(os.path.abspath(mesh_file).replace("\\", "/"))
+            osc = self._run_openscad(req, req.vp_script_lines + [import_line], render_file, req.animation_frames)
+            if not self._render_ok(osc):
+                return None
+        except Exception:
+            return None
+        finally:
+            if os.path.exists(mesh_file):
+                os.unlink(mesh_file)
+        osc.echos = mesh_osc.echos + osc.echos
+        return osc
+
+    def _run_openscad(self, req, script_lines, outfile, animate, export=False):
+        """Runs OpenSCAD on the given script lines, with the given request's
+        settings, to make the given output file.  If `export` is true, the
+        output file is geometry, not an image, so it isn't antialiased."""
+        # The script stays in the current directory, so that the paths it
+        # includes and imports resolve the same as always.  A unique name
+        # keeps runs sharing the directory from colliding.
+        base_name = os.path.basename(req.image_file)
+        with tempfile.NamedTemporaryFile(
+                prefix="tmp_{0}_".format(base_name.replace(".", "_")),
+                suffix=".scad", dir=".", mode="w", delete=False) as f:
+            for line in script_lines:
                 f.write(line + "\n")
+            script_file = f.name
 
         try:
             no_vp = True
-            for line in req.script_lines:
+            for line in script_lines:
                 if "$vp" in line:
                     no_vp = False
 
             render_mode = req.render_mode
-            animate = req.animation_frames
             if self.test_only:
                 render_mode = RenderMode.test_only
                 animate = None
 
             osc = OpenScadRunner(
                 script_file,
-                new_img_file,
+                outfile,
                 animate=animate,
                 animate_duration=req.frame_ms,
-                imgsize=req.imgsize,
-                antialias=2,
+                imgsize=self._render_size(req),
+                antialias=1 if export else 2,
                 orthographic=True,
                 camera=req.camera,
                 auto_center=no_vp,
@@ -281,8 +603,14 @@ class ImageManager(object):
 
         finally:
             os.unlink(script_file)
+        return osc
+
+    def _finish_request(self, req, osc):
+        """Compares the rendered image against the existing one, and replaces it if they differ."""
+        targ_img_file = req.image_file
+        new_img_file = self._rendered_file(req)[1]
 
-        if not osc.good() or osc.warnings or osc.errors:
+        if not self._render_ok(osc):
             osc.success = False
             req.completed("FAIL", osc)
             return
@@ -293,24 +621,58 @@ class ImageManager(object):
 
         os.makedirs(os.path.dirname(targ_img_file), exist_ok=True)
 
-        # Time to compare image.
+        status = self._install_image(new_img_file, targ_img_file)
+        req.variant_status = {}
+        if self._varies(req):
+            for scale in req.variants:
+                variant = variant_file(targ_img_file, scale)
+                req.variant_status[variant] = self._install_image(variant_file(new_img_file, scale), variant)
+        req.completed(status, osc)
+
+    def _install_image(self, new_img_file, targ_img_file):
+        """Replaces the target image with the new one, unless they are the
+        same.  Returns the status: "NEW", "REPLACE", or "SKIP".
+
+        The recorded digests of the target image are checked first, so it
+        only needs to be decoded when the new image is a near miss."""
+        digests = self.image_digests
+        info = None
         if not os.path.isfile(targ_img_file):
-            os.rename(new_img_file, targ_img_file)
-            req.completed("NEW", osc)
-        elif self.image_compare(targ_img_file, new_img_file):
-            os.unlink(new_img_file)
-            req.completed("SKIP", osc)
+            status = "NEW"
         else:
-            os.unlink(targ_img_file)
-            os.rename(new_img_file, targ_img_file)
-            req.completed("REPLACE", osc)
+            same = None
+            if digests:
+                same, info = digests.compare(targ_img_file, new_img_file)
+            if same is None:
+                same = self.image_compare(targ_img_file, new_img_file)
+            status = "SKIP" if same else "REPLACE"
+        if status == "SKIP":
+            os.unlink(new_img_file)
+            if digests and digests.get(targ_img_file) is None:
+                digests.update(targ_img_file)
+            return status
+        self._move_image(new_img_file, targ_img_file)
+        if digests:
+            digests.update(targ_img_file, info)
+        return status
+
+    @staticmethod
+    def _move_image(new_img_file, targ_img_file):
+        """Moves the new image over the target image.  The target is replaced,
+        never written through, so images sharing its inode are unchanged."""
+        try:
+            os.replace(new_img_file, targ_img_file)
+        except OSError:
+            # The scratch directory is on another filesystem.
+            clone_file(new_img_file, targ_img_file, hardlink=False)
+            os.unlink(new_img_file)
 
     @staticmethod
     def image_compare(file1, file2, max_diff=64.0):
         """
         Compare two image files.  Returns true if they are almost exactly the same.
         """
-        if file1.endswith(".gif") and file2.endswith(".gif"):
+        if file1.endswith((".gif", ".webp")) and file2.endswith((".gif", ".webp")):
             return filecmp.cmp(file1, file2, shallow=False)
         else:
             img1 = imread(file1).astype(float)
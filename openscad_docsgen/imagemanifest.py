@@ -0,0 +1,74 @@
+from __future__ import print_function
+
+import os
+import os.path
+import sys
+import json
+
+
+class ImageManifest(object):
+    """Remembers which images each source file's docs use, relative to the
+    docs directory, and which images are no longer used by any of them.
+    """
+    def __init__(self, manifest_file):
+        self.manifest_file = manifest_file
+        self.load()
+
+    def load(self):
+        """Reads the image manifest file.
+        """
+        self.files = {}
+        self.orphans = set()
+        if os.path.isfile(self.manifest_file):
+            try:
+                with open(self.manifest_file, "r") as f:
+                    data = json.load(f)
+                self.files = {src: set(images) for src, images in data["files"].items()}
+                self.orphans = set(data["orphans"])
+            except (ValueError, KeyError, TypeError) as e:
+                print("Corrupt image manifest file.  Ignoring.", file=sys.stderr)
+                sys.stderr.flush()
+                self.files = {}
+                self.orphans = set()
+
+    def save(self):
+        """Writes out the image manifest file.
+        """
+        os.makedirs(os.path.dirname(self.manifest_file), exist_ok=True)
+        data = {
+            "files": {src: sorted(images) for src, images in self.files.items()},
+            "orphans": sorted(self.orphans),
+        }
+        with open(self.manifest_file, "w") as f:
+            json.dump(data, f, sort_keys=True, indent=1)
+
+    def update(self, src_file, images):
+        """Records the images the given source file's docs now use.  Any
+        images it used before, that no other file uses, become orphans.
+        """
+        images = set(images)
+        old_images = self.files.get(src_file, set())
+        self.files[src_file] = images
+        self.orphans.update(old_images - images)
+        self.orphans.difference_update(images)
+
+    def forget_missing_sources(self):
+        """Orphans the images of source files that no longer exist.
+        """
+        for src_file in [src for src in self.files if not os.path.exists(src)]:
+            self.orphans.update(self.files.pop(src_file))
+
+    def get_orphans(self):
+        """Returns the sorted list of orphaned images that aren't used by any
+        source file's docs.
+        """
+        used = set()
+        for images in self.files.values():
+            used.update(images)
+        return sorted(self.orphans - used)
+
+    def clear_orphans(self):
+        self.orphans = set()
+
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 nowrap
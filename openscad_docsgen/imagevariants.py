@@ -0,0 +1,37 @@
+from __future__ import print_function
+
+import os.path
+
+from PIL import Image
+
+
+def variant_file(filename, scale):
+    """Returns the filename of the variant of the given image at the given
+    scale, like `images/foo/bar@2x.png` for a scale of 2.
+    """
+    base, ext = os.path.splitext(filename)
+    return "{}@{:g}x{}".format(base, scale, ext)
+
+
+def _scaled_size(imgsize, scale=1.0):
+    return (int(round(imgsize[0] * scale)), int(round(imgsize[1] * scale)))
+
+
+def make_variants(infile, imgsize, scales):
+    """Writes the variants of the still image in `infile` for each of the
+    given scales of `imgsize`, next to it.  Then scales `infile` itself to
+    `imgsize`.  All of them are resampled from the one image, which should
+    be rendered at the largest of the scales.
+    """
+    with Image.open(infile) as img:
+        img.load()
+    for scale in scales:
+        size = _scaled_size(imgsize, scale)
+        out = img if size == img.size else img.resize(size, Image.Resampling.LANCZOS)
+        out.save(variant_file(infile, scale), format="PNG")
+    size = _scaled_size(imgsize)
+    if size != img.size:
+        img.resize(size, Image.Resampling.LANCZOS).save(infile, format="PNG")
+
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 nowrap
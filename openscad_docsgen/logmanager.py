@@ -10,6 +10,11 @@ import platform
 from .errorlog import errorlog, ErrorLog
 
 class LogRequest(object):
+    __slots__ = (
+        "src_file", "src_line", "script_lines", "starting_cb", "completion_cb", "verbose",
+        "complete", "status", "success", "cmdline", "return_code",
+        "stdout", "stderr", "echos", "warnings", "errors",
+    )
     #_echo_re = re.compile(r"ECHO:\s*(.+)$")
     _echo_re = re.compile(r"ECHO:\s*(.+?)(?=\nECHO:|$)", re.DOTALL)
 
@@ -0,0 +1,107 @@
+from __future__ import print_function
+
+import os
+import os.path
+import sys
+import json
+
+from .filehashes import sha256sum
+
+
+class OutputManifest(object):
+    """Lists every file generated by a run, with its status and digest, so
+    that publishing steps can push only what changed.
+
+    Statuses are the same ones image requests use: "NEW", "REPLACE", "SKIP"
+    for unchanged files, and "FAIL".  Files listed in the previous manifest
+    that this run didn't generate are listed as "DELETE" if they have been
+    removed since.  If they still exist, they are listed as "ORPHAN" when
+    their generator ran and no longer produces them, or are otherwise kept
+    as they were listed before.
+    """
+    SCHEMA_VERSION = 1
+
+    def __init__(self, manifest_file):
+        self.manifest_file = manifest_file
+        self.load()
+
+    def load(self):
+        """Reads the manifest left by the previous run, if any.
+        """
+        self.prev_entries = {}
+        if os.path.isfile(self.manifest_file):
+            try:
+                with open(self.manifest_file, "r") as f:
+                    self.prev_entries = json.load(f).get("files", {})
+            except (ValueError, AttributeError) as e:
+                print("Corrupt manifest file.  Ignoring.", file=sys.stderr)
+                sys.stderr.flush()
+                self.prev_entries = {}
+
+    def _entry(self, path, kind, status, source=None):
+        entry = {"kind": kind, "status": status}
+        if source:
+            entry["source"] = source
+        if not os.path.isfile(path):
+            return entry
+        st = os.stat(path)
+        entry["size"] = st.st_size
+        entry["mtime"] = st.st_mtime
+        prev = self.prev_entries.get(path)
+        # Unchanged files keep their digest, instead of re-reading them.
+        if (
+            status in ("SKIP", "ORPHAN") and prev and "digest" in prev and
+            prev.get("size") == st.st_size and prev.get("mtime") == st.st_mtime
+        ):
+            entry["digest"] = prev["digest"]
+        else:
+            entry["digest"] = sha256sum(path)
+        return entry
+
+    @staticmethod
+    def _is_orphaned(prev, generators, sources):
+        """Returns True if the generator of the given previous entry ran, and
+        had the chance to produce it again.  Files generated from a single
+        source file only count if that source was processed, or is gone.
+        """
+        if prev.get("kind") not in generators:
+            return False
+        source = prev.get("source")
+        return not source or source in sources or not os.path.exists(source)
+
+    def get_entries(self, outputs, generators, sources):
+        """Returns the manifest entries for the given dictionary of output
+        paths to (kind, status, source) tuples, plus the files listed in the
+        previous manifest that weren't generated this run.  The `generators`
+        are the kinds of output generated this run, and `sources` are the
+        source files that were processed.
+        """
+        entries = {
+            path: self._entry(path, kind, status, source)
+            for path, (kind, status, source) in outputs.items()
+        }
+        for path, prev in self.prev_entries.items():
+            if path in entries:
+                continue
+            kind = prev.get("kind", "")
+            source = prev.get("source")
+            if not os.path.isfile(path):
+                if prev.get("status") != "DELETE":
+                    entries[path] = self._entry(path, kind, "DELETE", source)
+            elif self._is_orphaned(prev, generators, sources):
+                entries[path] = self._entry(path, kind, "ORPHAN", source)
+            else:
+                entries[path] = prev
+        return entries
+
+    def get_lines(self, outputs, generators, sources):
+        """Yields the lines of the JSON manifest for the given outputs.
+        """
+        data = {
+            "schema_version": self.SCHEMA_VERSION,
+            "files": self.get_entries(outputs, generators, sources),
+        }
+        yield json.dumps(data, sort_keys=True, indent=1)
+
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 nowrap
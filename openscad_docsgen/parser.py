@@ -5,15 +5,34 @@ import os.path
 import re
 import sys
 import glob
+import json
+import filecmp
+import hashlib
+import functools
+import multiprocessing
+
+try:
+    from importlib import metadata
+except ImportError:
+    metadata = None
 
 from .errorlog import ErrorLog, errorlog
 from .imagemanager import image_manager
+from .imagevariants import variant_file
+from .fileclone import clone_file
 from .blocks import *
 from .logmanager import log_manager
-from .filehashes import FileHashes
+from .filehashes import FileHashes, sha256sum
+from .docscache import DocsCache
+from .searchindex import SearchIndex
+from .docsdb import DocsDatabase
+from .manifest import OutputManifest
+from .imagemanifest import ImageManifest
 
 
 class OriginInfo:
+    __slots__ = ("file", "line")
+
     def __init__(self, file, line):
         self.file = file
         self.line = line
@@ -25,10 +44,49 @@ class OriginInfo:
         return self.file
 
 
+@functools.lru_cache(maxsize=None)
+def docsgen_version():
+    """Returns the installed version of openscad_docsgen, or "" if it can't be found."""
+    if metadata is None:
+        return ""
+    try:
+        return metadata.version("openscad_docsgen")
+    except metadata.PackageNotFoundError:
+        return ""
+
+
+# Set in the parent just before forking markdown workers, so they can read
+# the parsed tree and symbol tables without having them pickled.
+_docs_worker_state = None
+
+
+def _docs_worker_file_lines(task):
+    """Generates the markdown for one file, for one target, in a worker process.
+    Returns the lines, and any error log entries made while generating them.
+    """
+    parser, fblocks, targets = _docs_worker_state
+    tnum, index = task
+    fblock = fblocks[index]
+    target = targets[tnum]
+    errcount = len(errorlog.errlist)
+    # The image requests give the image sizes used in the markdown.  They get
+    # queued and rendered by the parent process, not here.
+    parser.queue_render_jobs(fblock.get_render_jobs(parser, target), target)
+    lines = list(target.postprocess(fblock.get_file_lines(parser, target)))
+    image_manager.purge_requests()
+    return lines, errorlog.errlist[errcount:], fblock.link_targets
+
+
 class DocsGenParser(object):
     _header_pat = re.compile(r"^// ([A-Z][A-Za-z0-9_&-]*( ?[A-Z][A-Za-z0-9_&-]*)?)(\([^)]*\))?:( .*)?$")
+    _link_name_pat = re.compile(r'\{\{([A-Za-z0-9_()]+)\}\}')
     RCFILE = ".openscad_docsgen_rc"
     HASHFILE = ".source_hashes"
+    DOCSCACHEFILE = ".docs_cache"
+    IMAGEMANIFESTFILE = ".image_manifest"
+    JSON_SCHEMA_VERSION = 1
+    # Kinds of output that aren't docs files, so aren't in the write counts.
+    UNCOUNTED_KINDS = ("image", "json", "sqlite", "manifest")
 
     def __init__(self, opts):
         self.opts = opts
@@ -49,6 +107,14 @@ class DocsGenParser(object):
         self.defn_aliases = {}
         self.syntags_data = {}
         self.default_colorscheme = "Cornfield"
+        self.written_files = []
+        self.unchanged_files = []
+        self.outputs = {}
+        self.generators = set()
+        self._queued_images = []
+        self._docscaches = {}
+        self._image_copies = []
+        self._rendered_images = {}
 
         sfx = self.target.get_suffix()
         self.TOCFILE = "TOC" + sfx
@@ -57,6 +123,7 @@ class DocsGenParser(object):
         self.GLOSSARYFILE = "Glossary" + sfx
         self.CHEATFILE = "CheatSheet" + sfx
         self.SIDEBARFILE = "_Sidebar" + sfx
+        self.SEARCHDIR = "search"
 
         self._reset_header_defs()
 
@@ -260,6 +327,18 @@ class DocsGenParser(object):
                     raise DocsGenException(title, "Body not supported, while declaring block:")
                 self.opts.png_animation = (subtitle.strip().upper() in ["TRUE", "YES", "1"])
                 self.opts.update_target()
+            elif title == "UseWebPAnimations":
+                if origin.file != self.RCFILE:
+                    raise DocsGenException(title, "Block disallowed outside of {} file:".format(self.RCFILE))
+                if body:
+                    raise DocsGenException(title, "Body not supported, while declaring block:")
+                self.opts.webp_animation = (subtitle.strip().upper() in ["TRUE", "YES", "1"])
+            elif title == "SplitIndices":
+                if origin.file != self.RCFILE:
+                    raise DocsGenException(title, "Block disallowed outside of {} file:".format(self.RCFILE))
+                if body:
+                    raise DocsGenException(title, "Body not supported, while declaring block:")
+                self.opts.split_indices = (subtitle.strip().upper() in ["TRUE", "YES", "1"])
             elif title == "ProjectName":
                 if origin.file != self.RCFILE:
                     raise DocsGenException(title, "Block disallowed outside of {} file:".format(self.RCFILE))
@@ -274,7 +353,6 @@ class DocsGenParser(object):
                     raise DocsGenException(title, "Body not supported, while declaring block:")
                 if not self.opts.set_target(subtitle.strip()):
                     raise DocsGenException(title, "Body not supported, while declaring block:")
-                self.opts.target_profile = subtitle.strip()
                 self.opts.update_target()
             elif title == "GenerateDocs":
                 if origin.file != self.RCFILE:
@@ -288,7 +366,8 @@ class DocsGenParser(object):
                     self.opts.gen_topics or
                     self.opts.gen_cheat or
                     self.opts.gen_sidebar or
-                    self.opts.gen_glossary
+                    self.opts.gen_glossary or
+                    self.opts.gen_search
                 ):
                     # Only use default GeneratedDocs if the command-line doesn't specify any docs
                     # types to generate.
@@ -309,6 +388,8 @@ class DocsGenParser(object):
                             self.opts.gen_glossary = True
                         elif part == "SIDEBAR":
                             self.opts.gen_sidebar = True
+                        elif part == "SEARCH":
+                            self.opts.gen_search = True
                         else:
                             raise DocsGenException(title, 'Unknown type "{}", while declaring block:'.format(orig_part))
             elif title == "SidebarHeader":
@@ -408,19 +489,19 @@ class DocsGenParser(object):
                         self.defn_aliases[term.lower()] = main_term
             elif title == "Figure":
                 self._check_filenode(title, origin)
-                FigureBlock(title, subtitle, body, origin, verbose=self.opts.verbose, parent=parent, enabled_features=self.opts.enabled_features, meta=meta, use_apngs=self.opts.png_animation)
+                FigureBlock(title, subtitle, body, origin, verbose=self.opts.verbose, parent=parent, enabled_features=self.opts.enabled_features, meta=meta, use_apngs=self.opts.png_animation, use_webp=self.opts.webp_animation)
             elif title == "Example":
                 if self.curr_item:
-                    ExampleBlock(title, subtitle, body, origin, verbose=self.opts.verbose, parent=parent, enabled_features=self.opts.enabled_features, meta=meta, use_apngs=self.opts.png_animation)
+                    ExampleBlock(title, subtitle, body, origin, verbose=self.opts.verbose, parent=parent, enabled_features=self.opts.enabled_features, meta=meta, use_apngs=self.opts.png_animation, use_webp=self.opts.webp_animation)
             elif title == "Figures":
                 self._check_filenode(title, origin)
                 for lnum, line in enumerate(body):
-                    FigureBlock("Figure", subtitle, [line], origin, verbose=self.opts.verbose, parent=parent, enabled_features=self.opts.enabled_features, meta=meta, use_apngs=self.opts.png_animation)
+                    FigureBlock("Figure", subtitle, [line], origin, verbose=self.opts.verbose, parent=parent, enabled_features=self.opts.enabled_features, meta=meta, use_apngs=self.opts.png_animation, use_webp=self.opts.webp_animation)
                     subtitle = ""
             elif title == "Examples":
                 if self.curr_item:
                     for lnum, line in enumerate(body):
-                        ExampleBlock("Example", subtitle, [line], origin, verbose=self.opts.verbose, enabled_features=self.opts.enabled_features, parent=parent, meta=meta, use_apngs=self.opts.png_animation)
+                        ExampleBlock("Example", subtitle, [line], origin, verbose=self.opts.verbose, enabled_features=self.opts.enabled_features, parent=parent, meta=meta, use_apngs=self.opts.png_animation, use_webp=self.opts.webp_animation)
                         subtitle = ""
             elif title == "Log":
                 if self.curr_item:
@@ -433,7 +514,7 @@ class DocsGenParser(object):
                     elif cls == TableBlock:
                         cls(title, subtitle, body, origin, parent=parent, header_sets=data)
                     elif cls in (FigureBlock, ExampleBlock):
-                        cls(title, subtitle, body, origin, parent=parent, meta=meta, use_apngs=self.opts.png_animation)
+                        cls(title, subtitle, body, origin, parent=parent, meta=meta, use_apngs=self.opts.png_animation, use_webp=self.opts.webp_animation)
                     if cb:
                         cb(title, subtitle, body, origin, meta)
 
@@ -629,7 +710,12 @@ class DocsGenParser(object):
                                         "echo(x);"
                                     ],
                                     // ... Next Example
-                                ]
+                                ],
+                                "example_images": [
+                                    "images/foobar/foobar.png",
+                                    null,
+                                    // ... Next Example's image, or null if it has none.
+                                ],
                                 "children": [
                                     {
                                         "name": "Extra Anchors",
@@ -742,44 +828,588 @@ class DocsGenParser(object):
         """Dumps debug info to stdout for all parsed documentation."""
         self.dump_tree(self.file_blocks)
 
+    def _write_lines(self, outfile, lines, kind="docs", source=None):
+        """Streams the given iterable of lines out to the given file.
+        The lines are written to a temporary file first, which only replaces
+        the output file if their contents differ.  Returns "NEW", "REPLACE",
+        or "SKIP", like image requests do.  The `kind` and `source` are
+        recorded for the manifest.
+        """
+        if not self.quiet:
+            print("Writing {}... ".format(outfile), end='')
+            sys.stdout.flush()
+        outdir, outname = os.path.split(outfile)
+        tmpfile = os.path.join(outdir, ".{}.{}.tmp".format(outname, os.getpid()))
+        try:
+            with open(tmpfile, "w") as f:
+                f.writelines(line + "\n" for line in lines)
+            if not os.path.isfile(outfile):
+                status = "NEW"
+            elif os.path.getsize(outfile) == os.path.getsize(tmpfile) and sha256sum(outfile) == sha256sum(tmpfile):
+                status = "SKIP"
+            else:
+                status = "REPLACE"
+            if status != "SKIP":
+                os.replace(tmpfile, outfile)
+        finally:
+            if os.path.exists(tmpfile):
+                os.unlink(tmpfile)
+        self._record_output(outfile, status, kind=kind, source=source)
+        if not self.quiet:
+            print("UNCHANGED" if status == "SKIP" else "")
+        return status
+
+    def _record_output(self, outfile, status, kind="docs", source=None):
+        """Records the status of a generated file, for the write counts and the manifest.
+        The `kind` names the generator that made it, and `source` is the source
+        file it was generated from, if it was generated from just one.
+        """
+        self.outputs[outfile] = (kind, status, source)
+        self.generators.add(kind)
+        if kind in self.UNCOUNTED_KINDS:
+            return
+        if status == "SKIP":
+            self.unchanged_files.append(outfile)
+        else:
+            self.written_files.append(outfile)
+
+    def _record_image_outputs(self, source):
+        """Records the status of each image queued since the last call, for
+        the given source file.  Images that weren't re-rendered because their
+        source is unchanged are recorded as unchanged.
+        """
+        for req in self._queued_images:
+            if req.complete:
+                self._record_output(req.image_file, req.status, kind="image", source=source)
+                for variant, status in req.variant_status.items():
+                    self._record_output(variant, status, kind="image", source=source)
+                continue
+            for image_file in [req.image_file] + [variant_file(req.image_file, scale) for scale in req.variants]:
+                if os.path.isfile(image_file):
+                    self._record_output(image_file, "SKIP", kind="image", source=source)
+        for req, src_file, image_file in self._image_copies:
+            for src_file, image_file in self._shared_image_files(src_file, image_file):
+                if image_file not in self.outputs and os.path.isfile(image_file):
+                    self._record_output(image_file, "SKIP", kind="image", source=source)
+        self._queued_images = []
+
+    def write_manifest(self, outfile):
+        """Writes a JSON manifest of every file generated this run, with its
+        status and digest, and of files a previous run generated that this
+        run didn't.
+        """
+        outdir = os.path.dirname(outfile)
+        if outdir:
+            os.makedirs(outdir, mode=0o744, exist_ok=True)
+        manifest = OutputManifest(outfile)
+        outputs = dict(self.outputs)
+        outputs.pop(outfile, None)
+        sources = set(fblock.origin.file for fblock in self.file_blocks)
+        lines = list(manifest.get_lines(outputs, self.generators, sources))
+        self._write_lines(outfile, lines, kind="manifest")
+
+    def report_write_counts(self):
+        """Prints how many docs files were written or left unchanged this run."""
+        if self.written_files or self.unchanged_files:
+            print("Wrote {} docs files, {} unchanged.".format(
+                len(self.written_files), len(self.unchanged_files)
+            ))
+
+    def get_render_plan(self, target=None):
+        """Returns a list of RenderJobs for every image and log that generating
+        the docs files would run, without generating any markdown.
+
+        Parameters
+        ----------
+        target : Target_Wiki
+            The output target to plan for.  Defaults to the current target.
+        """
+        target = target or self.opts.target
+        return [
+            job
+            for fblock in sorted(self.file_blocks, key=lambda x: x.subtitle.strip())
+            for job in fblock.get_render_jobs(self, target)
+        ]
+
+    def queue_render_jobs(self, jobs, target=None, queued=None):
+        """Queues an image request with the image manager for each image job
+        in the given render plan.  Log jobs are already queued while parsing.
+
+        If a `queued` dictionary is given, it maps the digests of the jobs
+        already queued to their image requests.  A job with the same digest
+        as one already queued, or as an image already rendered earlier in
+        this run, is not rendered again.  If its image goes to a different
+        path, it is linked there once the renders are done.
+        """
+        target = target or self.opts.target
+        for job in jobs:
+            if job.kind != "image":
+                continue
+            # Duplicates share the request, which also gives their
+            # markdown the image's size.
+            if queued is not None and job.digest in queued:
+                req = queued[job.digest]
+                job.block.image_req = req
+                if req.image_file != job.image_file:
+                    self._image_copies.append((req, req.image_file, job.image_file))
+                continue
+            req = self._rendered_images.get(job.digest)
+            if req and req.image_file != job.image_file:
+                job.block.image_req = req
+                self._image_copies.append((None, req.image_file, job.image_file))
+                continue
+            job.block.generate_image(target, self)
+            if job.block.image_req:
+                self._queued_images.append(job.block.image_req)
+                if queued is not None:
+                    queued[job.digest] = job.block.image_req
+
+    def _remember_rendered_images(self, queued):
+        """Remembers the images of the given queued requests that were
+        rendered this run, so that later identical examples can share them.
+        Images left from earlier runs aren't shared, as they may be stale.
+        """
+        for digest, req in queued.items():
+            if req.complete and req.success:
+                self._rendered_images.setdefault(digest, req)
+
+    @staticmethod
+    def _link_image(src_file, image_file):
+        """Puts a copy of `src_file` at `image_file`, sharing its storage
+        where the filesystem allows.  The shared source is never changed.
+        """
+        os.makedirs(os.path.dirname(image_file), mode=0o744, exist_ok=True)
+        clone_file(src_file, image_file)
+
+    def _copy_shared_images(self, source):
+        """Links each image rendered once to the other paths where targets
+        or identical examples in the given source file expect the same image.
+        """
+        for req, src_file, image_file in self._image_copies:
+            if req is not None and not req.success:
+                continue
+            for src_file, image_file in self._shared_image_files(src_file, image_file):
+                if not os.path.isfile(src_file):
+                    continue
+                if os.path.isfile(image_file):
+                    if os.path.samefile(src_file, image_file):
+                        self._record_output(image_file, "SKIP", kind="image", source=source)
+                        continue
+                    if filecmp.cmp(src_file, image_file, shallow=False):
+                        self._link_image(src_file, image_file)
+                        self._record_output(image_file, "SKIP", kind="image", source=source)
+                        continue
+                status = "REPLACE" if os.path.isfile(image_file) else "NEW"
+                self._link_image(src_file, image_file)
+                self._record_output(image_file, status, kind="image", source=source)
+        self._image_copies = []
+
+    @staticmethod
+    def _shared_image_files(src_file, image_file):
+        """Returns the (source, destination) pairs for sharing an image, and
+        for sharing each of its scaled variants.
+        """
+        pairs = [(src_file, image_file)]
+        pairs.extend(
+            (variant_file(src_file, scale), variant_file(image_file, scale))
+            for scale in image_manager.image_variants
+        )
+        return pairs
+
+    def _strip_file_block(self, fblock):
+        """In low-memory mode, reduces a file's tree to what the index files need."""
+        if self.opts.low_memory:
+            image_manager.purge_requests()
+            fblock.strip_to_summary()
+
+    def _json_export_lines(self):
+        """Yields the lines of the JSON export, encoding one file's data at a time."""
+        encoder = json.JSONEncoder()
+        header = encoder.encode({
+            "schema": "openscad_docsgen",
+            "schema_version": self.JSON_SCHEMA_VERSION,
+            "project_name": self.opts.project_name,
+        })
+        yield header[:-1] + ', "files": ['
+        prev = None
+        for fblock in sorted(self.file_blocks, key=lambda x: x.subtitle.strip()):
+            line = "".join(encoder.iterencode(fblock.get_data()))
+            if prev is not None:
+                yield prev + ","
+            prev = line
+        if prev is not None:
+            yield prev
+        yield "]}"
+
+    def write_json_file(self, outfile):
+        """Exports the parsed documentation tree to the given JSON file.
+
+        The result is a single JSON object.  Its first line holds the schema
+        name, schema version and project name, and opens the "files" list.
+        Each following line holds the data for one file, as returned by
+        get_all_data(), so consumers can load the files one at a time.
+        """
+        outdir = os.path.dirname(outfile)
+        if outdir:
+            os.makedirs(outdir, mode=0o744, exist_ok=True)
+        self._write_lines(outfile, self._json_export_lines(), kind="json")
+
+    def write_sqlite_file(self, outfile):
+        """Exports the parsed documentation tree to the given SQLite database file."""
+        outdir = os.path.dirname(outfile)
+        if outdir:
+            os.makedirs(outdir, mode=0o744, exist_ok=True)
+        if not self.quiet:
+            print("Writing {}... ".format(outfile))
+            sys.stdout.flush()
+        docsdb = DocsDatabase()
+        for fblock in sorted(self.file_blocks, key=lambda x: x.subtitle.strip()):
+            docsdb.add_file(fblock.get_data())
+        docsdb.add_definitions(self.definitions)
+        status = "REPLACE" if os.path.exists(outfile) else "NEW"
+        docsdb.write(outfile, project_name=self.opts.project_name)
+        self._record_output(outfile, status, kind="sqlite")
+
+    def _get_docs_cache(self, target):
+        cachefile = os.path.join(target.docs_dir, self.DOCSCACHEFILE)
+        if cachefile not in self._docscaches:
+            self._docscaches[cachefile] = DocsCache(cachefile)
+        return self._docscaches[cachefile]
+
+    def _link_target_fingerprint(self, name):
+        """Returns a string describing what the given link target name resolves to."""
+        if name in self.items_by_name:
+            item = self.items_by_name[name]
+            return "{}|{}|{}".format(item.origin.file, item.title, item.subtitle)
+        if name in self.definitions:
+            return "Glossary"
+        if name in self.defn_aliases:
+            return "Glossary|{}".format(self.defn_aliases[name].lower())
+        return ""
+
+    def _docs_cache_key(self, fblock, link_targets, target):
+        """Returns the cache key for a file's docs, from the source file's
+        contents, the settings that affect its markdown, the version of
+        docsgen, and what each of the given link target names currently
+        resolves to.
+        """
+        h = hashlib.sha256()
+        settings = [
+            docsgen_version(),
+            type(target).__name__,
+            str(target.project_name),
+            target.image_url(""),
+            str(self.opts.project_name),
+            ",".join(self.opts.enabled_features),
+            str(self.opts.png_animation),
+            str(self.opts.webp_animation),
+            str(self.opts.split_indices),
+            str(self.opts.image_variants),
+            sha256sum(self.RCFILE),
+            sha256sum(fblock.origin.file),
+        ]
+        for name in sorted(link_targets):
+            settings.append("{}={}".format(name, self._link_target_fingerprint(name)))
+        for line in settings:
+            h.update(line.encode("utf-8"))
+            h.update(b"\n")
+        return h.hexdigest()
+
+    def _generate_docs_lines(self, fblocks, targets, todos):
+        """Yields the postprocessed markdown lines for each of the given file
+        blocks, in order, for each of the given targets in turn, or None where
+        the target's list in `todos` doesn't mark the block.  If more than one
+        job was requested, the markdown for all the targets is generated in one
+        pool of forked worker processes.
+        """
+        global _docs_worker_state
+        tasks = [
+            (tnum, i)
+            for i in range(len(fblocks))
+            for tnum, todo in enumerate(todos)
+            if todo[i]
+        ]
+        jobs = min(self.opts.jobs, len(tasks))
+        if jobs <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+            for i, fblock in enumerate(fblocks):
+                for target, todo in zip(targets, todos):
+                    fblock.link_targets = set()
+                    yield target.postprocess(fblock.get_file_lines(self, target)) if todo[i] else None
+            return
+        _docs_worker_state = (self, fblocks, targets)
+        try:
+            with multiprocessing.get_context("fork").Pool(jobs) as pool:
+                results = pool.imap(_docs_worker_file_lines, tasks)
+                for i, fblock in enumerate(fblocks):
+                    for todo in todos:
+                        if not todo[i]:
+                            yield None
+                            continue
+                        lines, errors, link_targets = next(results)
+                        errorlog.merge_entries(errors)
+                        fblock.link_targets = link_targets
+                        yield lines
+        finally:
+            _docs_worker_state = None
+
+    def _get_image_manifest(self, target, manifests):
+        """Returns the image manifest for the given target's images directory,
+        from the given dictionary of manifests, so targets sharing a directory
+        share one.
+        """
+        manifest_file = os.path.join(target.images_dir, self.IMAGEMANIFESTFILE)
+        if manifest_file not in manifests:
+            manifests[manifest_file] = ImageManifest(manifest_file)
+        return manifests[manifest_file]
+
     def write_docs_files(self):
-        """Generates the docs files for each source file that has been parsed.
+        """Generates the docs files for each source file that has been parsed,
+        for each target.  Each image is rendered once, even when more than one
+        target or identical example uses it.  In low-memory mode, each file's
+        tree is stripped down after it is written.
         """
-        target = self.opts.target
+        targets = self.opts.targets
         if self.opts.test_only:
+            target = targets[0]
             for fblock in sorted(self.file_blocks, key=lambda x: x.subtitle.strip()):
-                lines = fblock.get_file_lines(self, target)
+                self.queue_render_jobs(fblock.get_render_jobs(self, target), target)
                 image_manager.process_requests(test_only=True)
+                self._queued_images = []
+                # Nothing is written, but generating the markdown still
+                # checks the links and See Also targets.
+                fblock.link_targets = set()
+                for line in fblock.get_file_lines(self, target):
+                    pass
+                self._strip_file_block(fblock)
             return
-        os.makedirs(target.docs_dir, mode=0o744, exist_ok=True)
-        filehashes = FileHashes(os.path.join(target.docs_dir, self.HASHFILE))
-        for fblock in sorted(self.file_blocks, key=lambda x: x.subtitle.strip()):
-            outfile = os.path.join(target.docs_dir, fblock.origin.file+target.get_suffix())
-            if not self.quiet:
-                print("Writing {}...".format(outfile))
-            outdir = os.path.dirname(outfile)
-            if not os.path.exists(outdir):
-                os.makedirs(outdir, mode=0o744, exist_ok=True)
-            out = fblock.get_file_lines(self, target)
-            out = target.postprocess(out)
-            with open(outfile,"w") as f:
-                for line in out:
-                    f.write(line + "\n")
+        fblocks = sorted(self.file_blocks, key=lambda x: x.subtitle.strip())
+        self.generators.add("docs")
+        if self.opts.gen_imgs:
+            self.generators.add("image")
+        plans = []
+        todos = []
+        imagemanifests = {}
+        for target in targets:
+            os.makedirs(target.docs_dir, mode=0o744, exist_ok=True)
+            filehashes = FileHashes(os.path.join(target.docs_dir, self.HASHFILE))
+            docscache = self._get_docs_cache(target)
+            outfiles = [
+                os.path.join(target.docs_dir, fblock.origin.file+target.get_suffix())
+                for fblock in fblocks
+            ]
+            # A file's markdown only depends on its own source and on what its
+            # links to other files resolve to.  Skip files where neither changed.
+            todos.append([
+                self.opts.force or not docscache.is_current(
+                    outfile,
+                    self._docs_cache_key(fblock, docscache.get_link_targets(outfile), target)
+                )
+                for fblock, outfile in zip(fblocks, outfiles)
+            ])
+            imagemanifest = self._get_image_manifest(target, imagemanifests)
+            plans.append((target, filehashes, docscache, imagemanifest, outfiles))
+        docs_lines = self._generate_docs_lines(fblocks, targets, todos)
+        for fnum, fblock in enumerate(fblocks):
+            queued = {}
+            for target, filehashes, docscache, imagemanifest, outfiles in plans:
+                outfile = outfiles[fnum]
+                out = next(docs_lines)
+                outdir = os.path.dirname(outfile)
+                if not os.path.exists(outdir):
+                    os.makedirs(outdir, mode=0o744, exist_ok=True)
+                jobs = list(fblock.get_render_jobs(self, target))
+                self.queue_render_jobs(jobs, target, queued)
+                imagemanifest.update(
+                    fblock.origin.file,
+                    [url for job in jobs if job.kind == "image" for url in job.block.get_image_urls()]
+                )
+                if out is None:
+                    if not self.quiet:
+                        print("Writing {}... CACHED".format(outfile))
+                    self._record_output(outfile, "SKIP", source=fblock.origin.file)
+                else:
+                    self._write_lines(outfile, out, source=fblock.origin.file)
+                    if errorlog.file_has_errors(fblock.origin.file):
+                        docscache.invalidate(outfile)
+                    else:
+                        key = self._docs_cache_key(fblock, fblock.link_targets, target)
+                        docscache.update(outfile, key, fblock.link_targets)
             if self.opts.gen_imgs:
                 filename = fblock.subtitle.strip()
-                has_changed = filehashes.is_changed(filename)
-                if self.opts.force or has_changed:
+                has_changed = [plan[1].is_changed(filename) for plan in plans]
+                if self.opts.force or any(has_changed):
                     image_manager.process_requests(test_only=False)
+                    self._copy_shared_images(fblock.origin.file)
+                self._remember_rendered_images(queued)
+                self._record_image_outputs(fblock.origin.file)
                 image_manager.purge_requests()
-                if errorlog.file_has_errors(filename):
-                    filehashes.invalidate(filename)
-                filehashes.save()
+                for target, filehashes, docscache, imagemanifest, outfiles in plans:
+                    if errorlog.file_has_errors(filename):
+                        filehashes.invalidate(filename)
+                    filehashes.save()
+            self._image_copies = []
+            self._queued_images = []
+            self._strip_file_block(fblock)
+        for target, filehashes, docscache, imagemanifest, outfiles in plans:
+            docscache.save()
+        for imagemanifest in imagemanifests.values():
+            imagemanifest.save()
+
+    def gc_images(self, delete=False):
+        """Lists, or deletes, the images that no source file's docs use any
+        more.  This uses the image manifest kept by write_docs_files(), rather
+        than searching the images directory.
+        """
+        images_dirs = []
+        for target in self.opts.targets:
+            if target.images_dir not in images_dirs:
+                images_dirs.append(target.images_dir)
+        for images_dir in images_dirs:
+            imagemanifest = ImageManifest(os.path.join(images_dir, self.IMAGEMANIFESTFILE))
+            imagemanifest.forget_missing_sources()
+            for image in imagemanifest.get_orphans():
+                image_file = os.path.join(images_dir, image)
+                if not os.path.isfile(image_file):
+                    continue
+                if not delete:
+                    print(image_file)
+                    continue
+                if not self.quiet:
+                    print("Deleting {}".format(image_file))
+                os.unlink(image_file)
+            if delete:
+                imagemanifest.clear_orphans()
+            imagemanifest.save()
+
+    def _link_fingerprints(self, text):
+        return [
+            (name, self._link_target_fingerprint(name))
+            for name in (x.lower().strip() for x in self._link_name_pat.findall(text))
+        ]
+
+    def _item_summary(self, item):
+        """Returns the item data used when an item is listed in an index file."""
+        return (
+            item.title, item.subtitle, item.origin.file, item.aliases,
+            item.synopsis, item.syntags, self._link_fingerprints(item.synopsis),
+        )
+
+    def _toc_file_data(self, prifiles):
+        def summary(block):
+            if isinstance(block, ItemBlock):
+                return self._item_summary(block)
+            return (
+                block.title, block.subtitle, block.origin.file,
+                [
+                    summary(child)
+                    for child in block.get_children_by_title(["Subsection","Constant","Function","Module","Function&Module"])
+                ],
+            )
+        return [
+            (
+                fblock.title, fblock.subtitle, fblock.origin.file, fblock.group, fblock.summary,
+                [(mark, note) for mark, note, origin in fblock.footnotes],
+                [summary(sect) for sect in fblock.children if isinstance(sect, SectionBlock)],
+            )
+            for fblock in prifiles
+        ]
+
+    def _glossary_file_data(self):
+        return sorted((key, info[1]) for key, info in self.definitions.items())
+
+    def _topics_file_data(self):
+        return [
+            self._item_summary(item) + (item.topics,)
+            for file_block in self.file_blocks
+            for section in file_block.children if isinstance(section, SectionBlock)
+            for item in section.children if isinstance(item, ItemBlock)
+        ]
 
-    def write_toc_file(self):
+    def _index_file_data(self):
+        return [
+            self._item_summary(item)
+            for file_block in self.file_blocks
+            for sect in file_block.get_children_by_title("Section")
+            for item in sect.children if isinstance(item, ItemBlock)
+        ]
+
+    def _cheatsheet_file_data(self, pri_blocks, target):
+        def summary(block):
+            return (
+                block.title, block.subtitle,
+                [summary(child) for child in block.get_children_by_title("Subsection")],
+                [
+                    (cnst.title, cnst.subtitle, cnst.origin.file, cnst.aliases)
+                    for cnst in block.get_children_by_title("Constant")
+                ],
+                [
+                    (item.title, item.subtitle, item.origin.file, [usage.body for usage in item.get_children_by_title("Usage")])
+                    for item in block.get_children_by_title(["Function","Module","Function&Module"])
+                ],
+            )
+        return [
+            target.project_name,
+            [
+                (fblock.title, fblock.subtitle, [summary(sect) for sect in fblock.get_children_by_title("Section")])
+                for fblock in pri_blocks
+            ],
+        ]
+
+    def _sidebar_file_data(self, prifiles):
+        opts = self.opts
+        return [
+            opts.sidebar_header, opts.sidebar_middle, opts.sidebar_footer,
+            opts.gen_toc, opts.gen_index, opts.gen_topics, opts.gen_glossary, opts.gen_cheat,
+            [
+                (fblock.subtitle, fblock.group, [(mark, note) for mark, note, origin in fblock.footnotes])
+                for fblock in prifiles
+            ],
+        ]
+
+    def _aggregate_key(self, data, target):
+        """Returns the cache key for an aggregate file generated from the given data."""
+        h = hashlib.sha256()
+        h.update(repr((docsgen_version(), type(target).__name__, target.project_name, data)).encode("utf-8"))
+        return h.hexdigest()
+
+    def _aggregate_is_current(self, outfile, key, target, shard_files=(), kind="docs"):
+        """Returns True if the given aggregate file, and any per-letter pages
+        split out of it, were last generated from the same data, and are
+        unchanged, so they do not need regenerating.
+        """
+        outfiles = [outfile]
+        outfiles.extend(shard_files)
+        docscache = self._get_docs_cache(target)
+        if self.opts.force or not all(docscache.is_current(x, key) for x in outfiles):
+            return False
+        for x in outfiles:
+            if not self.quiet:
+                print("Writing {}... CACHED".format(x))
+            self._record_output(x, "SKIP", kind=kind)
+        return True
+
+    def _write_aggregate(self, outfile, key, lines, errcount, target, kind="docs"):
+        """Writes out an aggregate file, and records the key it was generated with,
+        unless errors were logged since `errcount` entries were in the error log.
+        """
+        self._write_lines(outfile, lines, kind=kind)
+        docscache = self._get_docs_cache(target)
+        if len(errorlog.errlist) > errcount:
+            docscache.invalidate(outfile)
+        else:
+            docscache.update(outfile, key, [])
+        docscache.save()
+
+    def write_toc_file(self, target=None):
         """Generates the table-of-contents TOC file from the parsed documentation"""
-        target = self.opts.target
+        target = target or self.opts.target
         os.makedirs(target.docs_dir, mode=0o744, exist_ok=True)
         prifiles = self._files_prioritized()
+        outfile = os.path.join(target.docs_dir, self.TOCFILE)
+        key = self._aggregate_key(self._toc_file_data(prifiles), target)
+        if self._aggregate_is_current(outfile, key, target, kind="toc"):
+            return
+        errcount = len(errorlog.errlist)
         groups = []
         for fblock in prifiles:
             if fblock.group and fblock.group not in groups:
@@ -826,20 +1456,20 @@ class DocsGenParser(object):
             out.append("")
 
         for fnum, fblock in enumerate(prifiles):
-            out.extend(fblock.get_tocfile_lines(self, self.opts.target, n=fnum+1, currfile=self.TOCFILE))
+            out.extend(fblock.get_tocfile_lines(self, target, n=fnum+1, currfile=self.TOCFILE))
 
         out = target.postprocess(out)
-        outfile = os.path.join(target.docs_dir, self.TOCFILE)
-        if not self.quiet:
-            print("Writing {}...".format(outfile))
-        with open(outfile, "w") as f:
-            for line in out:
-                f.write(line + "\n")
+        self._write_aggregate(outfile, key, out, errcount, target, kind="toc")
 
-    def write_glossary_file(self):
+    def write_glossary_file(self, target=None):
         """Generates the Glossary file from the parsed documentation."""
-        target = self.opts.target
+        target = target or self.opts.target
         os.makedirs(target.docs_dir, mode=0o744, exist_ok=True)
+        outfile = os.path.join(target.docs_dir, self.GLOSSARYFILE)
+        key = self._aggregate_key(self._glossary_file_data(), target)
+        if self._aggregate_is_current(outfile, key, target, kind="glossary"):
+            return
+        errcount = len(errorlog.errlist)
         defs = {key: info[1] for key, info in self.definitions.items()}
         sorted_words = sorted(list(defs.keys()), key=lambda v: v.upper())
         ltrs_found = {}
@@ -870,17 +1500,59 @@ class DocsGenParser(object):
             out.extend(target.header(word.title(), lev=3))
             out.extend(target.markdown_block([defn]))
         out = target.postprocess(out)
-        outfile = os.path.join(target.docs_dir, self.GLOSSARYFILE)
-        if not self.quiet:
-            print("Writing {}...".format(outfile))
-        with open(outfile, "w") as f:
-            for line in out:
-                f.write(line + "\n")
-
-    def write_topics_file(self):
-        """Generates the Topics file from the parsed documentation."""
-        target = self.opts.target
+        self._write_aggregate(outfile, key, out, errcount, target, kind="glossary")
+
+    def get_shard_page(self, page, ltr):
+        """Returns the name of the page that holds the given letter of the
+        given index page, which depends on whether indices are split by letter.
+        """
+        if not self.opts.split_indices:
+            return page
+        return "{}_{}".format(page, ltr)
+
+    def get_topic_page(self, topic):
+        """Returns the name of the Topics page that lists the given topic."""
+        if not self.opts.split_indices:
+            return "Topics"
+        ltr = "0" if not topic[:1].isalpha() else topic[0].upper()
+        return self.get_shard_page("Topics", ltr)
+
+    def _shard_files(self, page, ltrs, target):
+        """Returns the output filenames of the per-letter pages of the given index page."""
+        if not self.opts.split_indices:
+            return []
+        return [
+            os.path.join(target.docs_dir, self.get_shard_page(page, ltr) + target.get_suffix())
+            for ltr in ltrs
+        ]
+
+    def _remove_stale_shards(self, page, shard_files, target):
+        """Removes per-letter pages of the given index page for letters that no longer have entries."""
+        # Only match the shard names we generate, so that docs pages of
+        # source files like Topics_foo.scad are left alone.
+        shard_re = re.compile(r'^{}_[A-Z0]{}$'.format(re.escape(page), re.escape(target.get_suffix())))
+        pat = os.path.join(target.docs_dir, "{}_?{}".format(page, target.get_suffix()))
+        for outfile in glob.glob(pat):
+            if shard_re.match(os.path.basename(outfile)) and outfile not in shard_files:
+                os.unlink(outfile)
+
+    def _shard_nav_lines(self, page, ltrs, target, anchors=False):
+        """Returns the markdown line of links to each letter of an index page."""
+        return target.markdown_block([
+            "  ".join(
+                target.get_link(ltr, anchor=ltr.lower(), literalize=False)
+                if anchors else
+                target.get_link(ltr, file=self.get_shard_page(page, ltr), literalize=False)
+                for ltr in ltrs
+            )
+        ])
+
+    def write_topics_file(self, target=None):
+        """Generates the Topics file from the parsed documentation.
+        If indices are split, each letter's topics go in their own page."""
+        target = target or self.opts.target
         os.makedirs(target.docs_dir, mode=0o744, exist_ok=True)
+        outfile = os.path.join(target.docs_dir, self.TOPICFILE)
         index_by_letter = {}
         for file_block in self.file_blocks:
             for section in file_block.children:
@@ -900,6 +1572,29 @@ class DocsGenParser(object):
                         for name in names:
                             index_by_letter[ltr][topic].append( (name, item) )
         ltrs_found = sorted(index_by_letter.keys())
+        shard_files = self._shard_files("Topics", ltrs_found, target)
+        key = self._aggregate_key((self.opts.split_indices, self._topics_file_data()), target)
+        if self._aggregate_is_current(outfile, key, target, shard_files, kind="topics"):
+            return
+        errcount = len(errorlog.errlist)
+
+        def topic_lines(ltr, currfile):
+            out = []
+            topics = sorted(index_by_letter[ltr].keys())
+            for topic in topics:
+                itemlist = index_by_letter[ltr][topic]
+                out.extend(target.header(topic, lev=target.ITEM))
+                out.extend(target.bullet_list_start())
+                sorted_items = sorted(itemlist, key=lambda x: x[0].lower())
+                for name, item in sorted_items:
+                    out.extend(
+                        target.bullet_list_item(
+                            item.get_index_line(self, target, currfile)
+                        )
+                    )
+                out.extend(target.bullet_list_end())
+            return out
+
         out = target.header("Topic Index")
         out.extend(target.markdown_block([
             "An index of topics, with related functions, modules, and constants."
@@ -913,6 +1608,7 @@ class DocsGenParser(object):
                             target.get_link(
                                 target.escape_entities(topic),
                                 anchor=target.header_link(topic),
+                                file="" if not shard_files else self.get_topic_page(topic),
                                 literalize=False
                             )
                             for topic in sorted(index_by_letter[ltr].keys())
@@ -920,33 +1616,28 @@ class DocsGenParser(object):
                     )
                 ])
             )
-        for ltr in ltrs_found:
-            topics = sorted(index_by_letter[ltr].keys())
-            for topic in topics:
-                itemlist = index_by_letter[ltr][topic]
-                out.extend(target.header(topic, lev=target.ITEM))
-                out.extend(target.bullet_list_start())
-                sorted_items = sorted(itemlist, key=lambda x: x[0].lower())
-                for name, item in sorted_items:
-                    out.extend(
-                        target.bullet_list_item(
-                            item.get_index_line(self, target, self.TOPICFILE)
-                        )
-                    )
-                out.extend(target.bullet_list_end())
+        if not shard_files:
+            for ltr in ltrs_found:
+                out.extend(topic_lines(ltr, self.TOPICFILE))
 
         out = target.postprocess(out)
-        outfile = os.path.join(target.docs_dir, self.TOPICFILE)
-        if not self.quiet:
-            print("Writing {}...".format(outfile))
-        with open(outfile, "w") as f:
-            for line in out:
-                f.write(line + "\n")
-
-    def write_index_file(self):
-        """Generates the alphabetical function/module/constant AlphaIndex file from the parsed documentation."""
-        target = self.opts.target
+        self._write_aggregate(outfile, key, out, errcount, target, kind="topics")
+
+        for ltr, shard_file in zip(ltrs_found, shard_files):
+            out = target.header("Topic Index: {}".format(ltr))
+            out.extend(self._shard_nav_lines("Topics", ltrs_found, target))
+            out.extend(topic_lines(ltr, os.path.basename(shard_file)))
+            out = target.postprocess(out)
+            self._write_aggregate(shard_file, key, out, errcount, target, kind="topics")
+        if self.opts.split_indices:
+            self._remove_stale_shards("Topics", shard_files, target)
+
+    def write_index_file(self, target=None):
+        """Generates the alphabetical function/module/constant AlphaIndex file from the parsed documentation.
+        If indices are split, each letter's entries go in their own page."""
+        target = target or self.opts.target
         os.makedirs(target.docs_dir, mode=0o744, exist_ok=True)
+        outfile = os.path.join(target.docs_dir, self.INDEXFILE)
         unsorted_items = []
         for file_block in self.file_blocks:
             for sect in file_block.get_children_by_title("Section"):
@@ -967,58 +1658,93 @@ class DocsGenParser(object):
                 index_by_letter[ltr] = []
             index_by_letter[ltr].append( (name, item ) )
         ltrs_found = sorted(index_by_letter.keys())
+        shard_files = self._shard_files("AlphaIndex", ltrs_found, target)
+        key = self._aggregate_key((self.opts.split_indices, self._index_file_data()), target)
+        if self._aggregate_is_current(outfile, key, target, shard_files, kind="index"):
+            return
+        errcount = len(errorlog.errlist)
         out = target.header("Alphabetical Index")
         out.extend(target.markdown_block([
             "An index of Functions, Modules, and Constants by name.",
         ]))
-        out.extend(target.markdown_block([
-            "  ".join(
-                target.get_link(ltr, anchor=ltr.lower(), literalize=False)
-                for ltr in ltrs_found
-            )
-        ]))
-        for ltr in ltrs_found:
-            items = [
-                item.get_index_line(self, target, self.INDEXFILE)
-                for name, item in index_by_letter[ltr]
-            ]
-            out.extend(target.header(ltr, lev=target.SUBSECTION))
-            out.extend(target.bullet_list(items))
+        out.extend(self._shard_nav_lines("AlphaIndex", ltrs_found, target, anchors=not shard_files))
+        if not shard_files:
+            for ltr in ltrs_found:
+                items = [
+                    item.get_index_line(self, target, self.INDEXFILE)
+                    for name, item in index_by_letter[ltr]
+                ]
+                out.extend(target.header(ltr, lev=target.SUBSECTION))
+                out.extend(target.bullet_list(items))
 
         out = target.postprocess(out)
-        outfile = os.path.join(target.docs_dir, self.INDEXFILE)
-        if not self.quiet:
-            print("Writing {}...".format(outfile))
-        with open(outfile, "w") as f:
-            for line in out:
-                f.write(line + "\n")
+        self._write_aggregate(outfile, key, out, errcount, target, kind="index")
+
+        for ltr, shard_file in zip(ltrs_found, shard_files):
+            out = target.header("Alphabetical Index: {}".format(ltr))
+            out.extend(self._shard_nav_lines("AlphaIndex", ltrs_found, target))
+            out.extend(target.bullet_list([
+                item.get_index_line(self, target, os.path.basename(shard_file))
+                for name, item in index_by_letter[ltr]
+            ]))
+            out = target.postprocess(out)
+            self._write_aggregate(shard_file, key, out, errcount, target, kind="index")
+        if self.opts.split_indices:
+            self._remove_stale_shards("AlphaIndex", shard_files, target)
 
-    def write_cheatsheet_file(self):
+    def write_search_index(self, target=None):
+        """Generates the sharded search index files from the parsed documentation."""
+        target = target or self.opts.target
+        outdir = os.path.join(target.docs_dir, self.SEARCHDIR)
+        os.makedirs(outdir, mode=0o744, exist_ok=True)
+        index = SearchIndex()
+        for file_block in self.file_blocks:
+            for sect in file_block.get_children_by_title("Section"):
+                for item in sect.children:
+                    if isinstance(item, ItemBlock):
+                        anchor = target.header_link("{}: {}".format(item.title, item.subtitle))
+                        index.add_item(item, target.get_url(anchor=anchor, file=item.origin.file))
+        outfiles = []
+        for filename, lines in index.get_files():
+            outfile = os.path.join(outdir, filename)
+            self._write_lines(outfile, lines, kind="search")
+            outfiles.append(outfile)
+        # Remove shards for initial letters that no longer have any terms.
+        for outfile in glob.glob(os.path.join(outdir, "*.json")):
+            if outfile not in outfiles:
+                os.unlink(outfile)
+
+    def write_cheatsheet_file(self, target=None):
         """Generates the CheatSheet file from the parsed documentation."""
-        target = self.opts.target
+        target = target or self.opts.target
         os.makedirs(target.docs_dir, mode=0o744, exist_ok=True)
+        pri_blocks = self._files_prioritized()
+        outfile = os.path.join(target.docs_dir, self.CHEATFILE)
+        key = self._aggregate_key(self._cheatsheet_file_data(pri_blocks, target), target)
+        if self._aggregate_is_current(outfile, key, target, kind="cheatsheet"):
+            return
+        errcount = len(errorlog.errlist)
         if target.project_name is None:
             title = "Cheat Sheet"
         else:
             title = "{} Cheat Sheet".format(target.project_name)
         out = target.header(title)
-        pri_blocks = self._files_prioritized()
         for file_block in pri_blocks:
-            out.extend(file_block.get_cheatsheet_lines(self, self.opts.target))
+            out.extend(file_block.get_cheatsheet_lines(self, target))
 
         out = target.postprocess(out)
-        outfile = os.path.join(target.docs_dir, self.CHEATFILE)
-        if not self.quiet:
-            print("Writing {}...".format(outfile))
-        with open(outfile, "w") as f:
-            for line in out:
-                f.write(line + "\n")
+        self._write_aggregate(outfile, key, out, errcount, target, kind="cheatsheet")
 
-    def write_sidebar_file(self):
+    def write_sidebar_file(self, target=None):
         """Generates the _Sidebar index of files from the parsed documentation"""
-        target = self.opts.target
+        target = target or self.opts.target
         os.makedirs(target.docs_dir, mode=0o744, exist_ok=True)
         prifiles = self._files_prioritized()
+        outfile = os.path.join(target.docs_dir, self.SIDEBARFILE)
+        key = self._aggregate_key(self._sidebar_file_data(prifiles), target)
+        if self._aggregate_is_current(outfile, key, target, kind="sidebar"):
+            return
+        errcount = len(errorlog.errlist)
         groups = []
         for fblock in prifiles:
             if fblock.group and fblock.group not in groups:
@@ -1077,12 +1803,7 @@ class DocsGenParser(object):
             out.extend(self.opts.sidebar_footer)
 
         out = target.postprocess(out)
-        outfile = os.path.join(target.docs_dir, self.SIDEBARFILE)
-        if not self.quiet:
-            print("Writing {}...".format(outfile))
-        with open(outfile, "w") as f:
-            for line in out:
-                f.write(line + "\n")
+        self._write_aggregate(outfile, key, out, errcount, target, kind="sidebar")
 
 
 
@@ -0,0 +1,33 @@
+from __future__ import print_function
+
+import os
+import os.path
+
+from PIL import Image
+
+
+def optimize_png(filename):
+    """Losslessly recompresses the given PNG file in place, if that makes it
+    smaller.  The image mode is kept as it is, so the pixels read back from
+    the file are unchanged.
+
+    Returns the size in bytes of the file before and after.
+    """
+    old_size = os.path.getsize(filename)
+    outdir, outname = os.path.split(filename)
+    tmpfile = os.path.join(outdir, "tmp_opt_{}".format(outname))
+    try:
+        with Image.open(filename) as img:
+            if getattr(img, "n_frames", 1) > 1:
+                return old_size, old_size
+            img.load()
+            img.save(tmpfile, format="PNG", optimize=True)
+        if os.path.getsize(tmpfile) < old_size:
+            os.replace(tmpfile, filename)
+    finally:
+        if os.path.exists(tmpfile):
+            os.unlink(tmpfile)
+    return old_size, os.path.getsize(filename)
+
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 nowrap
@@ -0,0 +1,104 @@
+from __future__ import print_function
+
+import re
+import json
+
+
+class SearchIndex(object):
+    """Builds a compact inverted index of item names, aliases, topics,
+    synopses and syntags, for client-side searching of the docs.
+
+    The index is written out as a set of small JSON files:
+
+    - `index.json` holds the schema version, the list of shard names, and
+      the list of documents.  Each document is a list of the item's name,
+      type, the URL of its docs, and synopsis, with any `{{name}}` links in
+      it reduced to just the linked name.  The URL is relative to the
+      docs directory, like the links between docs pages.
+    - One shard file per initial letter of the indexed terms, named like
+      `a.json`, with terms that don't start with a letter going in `0.json`.
+      Each shard maps its terms, in sorted order, to their posting lists.
+
+    A posting list is the sorted list of document numbers that a term occurs
+    in, delta-encoded so that each entry is the difference from the previous
+    one.  A client only needs to load the shard for the first letter of a
+    query, and can then find all terms with the query as a prefix.
+    """
+    SCHEMA_VERSION = 1
+    _word_pat = re.compile(r'[a-z0-9_$]+')
+    _link_pat = re.compile(r'\{\{([A-Za-z0-9_()]+)\}\}')
+
+    def __init__(self):
+        self.docs = []
+        self.postings = {}
+
+    def _terms(self, text, min_len=1):
+        for word in self._word_pat.findall(text.lower()):
+            if len(word) >= min_len:
+                yield word
+            parts = [part for part in word.split("_") if part]
+            if len(parts) > 1:
+                for part in parts:
+                    if len(part) >= min_len:
+                        yield part
+
+    def add_item(self, item, url):
+        """Adds an ItemBlock to the index, linked to the given URL of its docs."""
+        docnum = len(self.docs)
+        name = re.sub(r'\(.*$', '', item.subtitle).strip()
+        synopsis = self._link_pat.sub(r'\1', item.synopsis)
+        self.docs.append([name, item.title, url, synopsis])
+        terms = set(self._terms(name))
+        for alias in item.aliases:
+            terms.update(self._terms(alias))
+        for topic in item.topics:
+            terms.update(self._terms(topic))
+        for tag in item.syntags:
+            terms.update(self._terms(tag))
+        terms.update(self._terms(synopsis, min_len=3))
+        for term in terms:
+            self.postings.setdefault(term, []).append(docnum)
+
+    @staticmethod
+    def shard_name(term):
+        """Returns the name of the shard that the given term is stored in."""
+        return term[0] if term[0].isalpha() else "0"
+
+    @staticmethod
+    def delta_encode(nums):
+        """Delta-encodes a sorted list of numbers."""
+        prev = 0
+        out = []
+        for num in nums:
+            out.append(num - prev)
+            prev = num
+        return out
+
+    def get_shards(self):
+        """Returns a dictionary of shard names to shard data."""
+        shards = {}
+        for term in sorted(self.postings.keys()):
+            shard = shards.setdefault(self.shard_name(term), {})
+            shard[term] = self.delta_encode(self.postings[term])
+        return shards
+
+    def get_files(self):
+        """Yields (filename, lines) for each file of the index."""
+        shards = self.get_shards()
+        encoder = json.JSONEncoder(separators=(",", ":"), sort_keys=True)
+        header = encoder.encode({
+            "schema_version": self.SCHEMA_VERSION,
+            "shards": sorted(shards.keys()),
+        })
+        # One document per line keeps diffs between runs readable.
+        lines = [header[:-1] + ',"docs":[']
+        lines.extend(encoder.encode(doc) + "," for doc in self.docs)
+        if self.docs:
+            lines[-1] = lines[-1][:-1]
+        lines.append("]}")
+        yield "index.json", lines
+        for name in sorted(shards.keys()):
+            yield name + ".json", [encoder.encode(shards[name])]
+
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 nowrap
@@ -0,0 +1,120 @@
+from __future__ import print_function
+
+import re
+import math
+from xml.etree import ElementTree
+
+from PIL import Image, ImageDraw, ImageChops
+
+
+# The background, 2D face, and axes colors of OpenSCAD's color schemes.
+COLOR_SCHEMES = {
+    "Cornfield":      ("#ffffe5", "#f9d72c", "#000000"),
+    "Metallic":       ("#aaaaff", "#ddddff", "#000000"),
+    "Sunset":         ("#aa4444", "#ffaaaa", "#000000"),
+    "Starnight":      ("#000000", "#ffffe0", "#e0e0e0"),
+    "BeforeDawn":     ("#333333", "#cccccc", "#e0e0e0"),
+    "Nature":         ("#fafafa", "#16a085", "#000000"),
+    "DeepOcean":      ("#333333", "#eeeeee", "#e0e0e0"),
+    "Solarized":      ("#fdf6e3", "#b58900", "#000000"),
+    "Tomorrow":       ("#ffffff", "#f5871f", "#000000"),
+    "Tomorrow Night": ("#1d1f21", "#de935f", "#e0e0e0"),
+}
+
+_path_token_re = re.compile(r'[MLZmlz]|[-+]?(?:[0-9]*\.[0-9]+|[0-9]+)(?:[eE][-+]?[0-9]+)?')
+
+
+def _parse_path(d):
+    """Returns the polygons in an SVG path's data, as written by OpenSCAD,
+    which only uses absolute moveto, lineto, and closepath commands.
+    """
+    polys = []
+    poly = []
+    nums = []
+    for token in _path_token_re.findall(d):
+        if token in "Zz":
+            if poly:
+                polys.append(poly)
+            poly = []
+        elif token in "MmLl":
+            if token in "Mm" and poly:
+                polys.append(poly)
+                poly = []
+        else:
+            nums.append(float(token))
+            if len(nums) == 2:
+                poly.append(tuple(nums))
+                nums = []
+    if poly:
+        polys.append(poly)
+    return [poly for poly in polys if len(poly) > 2]
+
+
+def read_svg_polygons(svgfile):
+    """Returns a list of all the polygons in the paths of the given SVG file."""
+    polys = []
+    for elem in ElementTree.parse(svgfile).iter():
+        if elem.tag.rsplit("}", 1)[-1] == "path":
+            polys.extend(_parse_path(elem.get("d", "")))
+    return polys
+
+
+def _tick_step(span):
+    """Returns a round step between scale ticks, for about ten ticks across the span."""
+    step = 10 ** math.floor(math.log10(max(span, 1e-9) / 10))
+    for mult in (1, 2, 5, 10):
+        if span / (step * mult) <= 10:
+            return step * mult
+    return step * 10
+
+
+def rasterize_svg(svgfile, outfile, imgsize, color_scheme="Cornfield", show_axes=True, show_scales=True, antialias=2):
+    """Draws the 2D geometry in an SVG file exported by OpenSCAD to a PNG
+    image, framed and colored like OpenSCAD's own top-down view of it.
+    Overlapping polygons are filled with the even-odd rule, so holes stay
+    open.  The image is drawn at `antialias` times the size, and scaled down.
+    """
+    bg_color, face_color, axes_color = COLOR_SCHEMES[color_scheme]
+    width = int(imgsize[0] * antialias)
+    height = int(imgsize[1] * antialias)
+    polys = read_svg_polygons(svgfile)
+    points = [pt for poly in polys for pt in poly] or [(-1.0, -1.0), (1.0, 1.0)]
+    minx = min(x for x, y in points)
+    maxx = max(x for x, y in points)
+    miny = min(y for x, y in points)
+    maxy = max(y for x, y in points)
+    # Fit the geometry to the image with a margin, like --viewall does.
+    scale = 0.8 * min(width / max(maxx - minx, 1e-9), height / max(maxy - miny, 1e-9))
+    cx = (minx + maxx) / 2
+    cy = (miny + maxy) / 2
+
+    def to_px(pt):
+        return (width / 2 + (pt[0] - cx) * scale, height / 2 + (pt[1] - cy) * scale)
+
+    img = Image.new("RGB", (width, height), bg_color)
+    draw = ImageDraw.Draw(img)
+    ox, oy = to_px((0.0, 0.0))
+    if show_axes:
+        draw.line([(0, oy), (width, oy)], fill=axes_color, width=antialias)
+        draw.line([(ox, 0), (ox, height)], fill=axes_color, width=antialias)
+    if show_scales:
+        step = _tick_step(max(width, height) / scale)
+        tick = 3 * antialias
+        count = int(max(width, height) / (step * scale)) + 1
+        for i in range(-count, count + 1):
+            if i == 0:
+                continue
+            x, y = to_px((i * step, i * step))
+            draw.line([(x, oy - tick), (x, oy + tick)], fill=axes_color, width=antialias)
+            draw.line([(ox - tick, y), (ox + tick, y)], fill=axes_color, width=antialias)
+    mask = Image.new("1", (width, height), 0)
+    for poly in polys:
+        poly_mask = Image.new("1", (width, height), 0)
+        ImageDraw.Draw(poly_mask).polygon([to_px(pt) for pt in poly], fill=1)
+        mask = ImageChops.logical_xor(mask, poly_mask)
+    img.paste(face_color, mask=mask)
+    img = img.resize((int(imgsize[0]), int(imgsize[1])), Image.Resampling.LANCZOS)
+    img.save(outfile, format="PNG")
+
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 nowrap
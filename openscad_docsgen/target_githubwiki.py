@@ -6,14 +6,14 @@ from .target_wiki import Target_Wiki
 
 
 class Target_GitHubWiki(Target_Wiki):
-    def __init__(self, project_name=None, docs_dir="docs"):
-        super().__init__(project_name=project_name, docs_dir=docs_dir)
+    def __init__(self, project_name=None, docs_dir="docs", images_dir=None):
+        super().__init__(project_name=project_name, docs_dir=docs_dir, images_dir=images_dir)
 
-    def image_block(self, item_name, title, subtitle="", code=[], code_below=False, rel_url=None, width='', height=''):
+    def image_block(self, item_name, title, subtitle="", code=[], code_below=False, rel_url=None, width='', height='', srcset=None):
         out = []
         out.extend(self.block_header(title, subtitle, escsub=False))
         if rel_url:
-            out.extend(self.image(item_name, title, rel_url, width=width, height=height))
+            out.extend(self.image(item_name, title, rel_url, width=width, height=height, srcset=srcset))
         if code_below:
             out.extend(self.markdown_block(['<br clear="all" />']))
         out.extend(self.code_block(code))
@@ -21,14 +21,21 @@ class Target_GitHubWiki(Target_Wiki):
             out.extend(self.markdown_block(['<br clear="all" /><br/>']))
         return out
 
-    def image(self, item_name, img_type="", rel_url="", height='', width=''):
+    def image(self, item_name, img_type="", rel_url="", height='', width='', srcset=None):
         width = ' width="{}"'.format(width) if width else ''
         height = ' height="{}"'.format(height) if width else ''
+        if srcset:
+            srcset = ' srcset="{}"'.format(", ".join(
+                "{} {:g}x".format(url, scale)
+                for url, scale in [(rel_url, 1)] + list(srcset)
+            ))
+        else:
+            srcset = ''
         return [
-            '<img align="left" alt="{0} {1}" src="{2}"{3}{4}>'.format(
+            '<img align="left" alt="{0} {1}" src="{2}"{3}{4}{5}>'.format(
                 self.escape_entities(item_name),
                 self.escape_entities(img_type),
-                rel_url, width, height
+                rel_url, width, height, srcset
             ),
             ""
         ]
@@ -1,6 +1,18 @@
 from __future__ import print_function
 
+import os.path
 import re
+import functools
+
+
+_quot_pat = re.compile(r'([^`]*)(`[^`]*`)(.*$)')
+_ref_pat = re.compile("[^a-z0-9_ -]")
+_escape_table = str.maketrans({
+    '_': r'\_',
+    '&': r'&amp;',
+    '<': r'&lt;',
+    '>': r'&gt;',
+})
 
 
 class Target_Wiki(object):
@@ -8,34 +20,42 @@ class Target_Wiki(object):
     SECTION = 2
     SUBSECTION = 2
     ITEM = 3
-    def __init__(self, project_name=None, docs_dir="docs"):
+    def __init__(self, project_name=None, docs_dir="docs", images_dir=None):
         self.docs_dir = docs_dir
+        self.images_dir = images_dir or docs_dir
         self.project_name = project_name
 
     def get_suffix(self):
         return ".md"
 
+    def image_url(self, rel_url, file_dir=""):
+        """Returns the URL of an image from the docs file in the given
+        subdirectory that shows it, given what its URL would be if the images
+        directory were the docs directory.
+        """
+        if self.images_dir == self.docs_dir:
+            return rel_url
+        image_file = os.path.join(self.images_dir, file_dir, rel_url)
+        return os.path.relpath(image_file, os.path.join(self.docs_dir, file_dir))
+
     def postprocess(self, lines):
         return lines
 
+    @functools.lru_cache(maxsize=8192)
     def escape_entities(self, txt):
         """
         Escapes markdown symbols for underscores, ampersands, less-than and
         greater-than symbols.
         """
-        out = ""
-        quotpat = re.compile(r'([^`]*)(`[^`]*`)(.*$)')
+        out = []
         while txt:
-            m = quotpat.match(txt)
+            m = _quot_pat.match(txt)
             unquot  = m.group(1) if m else txt
             literal = m.group(2) if m else ""
             txt     = m.group(3) if m else ""
-            unquot = unquot.replace(r'_', r'\_')
-            unquot = unquot.replace(r'&', r'&amp;')
-            unquot = unquot.replace(r'<', r'&lt;')
-            unquot = unquot.replace(r'>', r'&gt;')
-            out += unquot + literal
-        return out
+            out.append(unquot.translate(_escape_table))
+            out.append(literal)
+        return "".join(out)
 
     def bold(self, txt):
         return "**{}**".format(txt)
@@ -55,8 +75,7 @@ class Target_Wiki(object):
         return [">" + lines]
 
     def paragraph(self, lines=[]):
-        lines.append("")
-        return lines
+        return lines + [""]
 
     def mouseover_tags(self, tags, file=None, htag="sup", wrap="{}"):
         if not file:
@@ -77,26 +96,32 @@ class Target_Wiki(object):
         )
         return out
 
+    @functools.lru_cache(maxsize=8192)
     def header_link(self, name):
         """
         Generates markdown link for a header.
         """
-        refpat = re.compile("[^a-z0-9_ -]")
-        return refpat.sub("", name.lower()).replace(" ", "-")
+        return _ref_pat.sub("", name.lower()).replace(" ", "-")
 
     def indent_lines(self, lines):
         return [" "*4 + line for line in lines]
 
+    def get_url(self, anchor="", file=""):
+        """Returns the URL that links to the given anchor of the given docs page."""
+        if anchor:
+            return "{}#{}".format(file, anchor)
+        return file
+
+    @functools.lru_cache(maxsize=8192)
     def get_link(self, label, anchor="", file="", literalize=True, html=False):
         if literalize:
             label = "`{0}`".format(label)
         else:
             label = self.escape_entities(label)
-        if anchor:
-            anchor = "#" + anchor
+        url = self.get_url(anchor=anchor, file=file)
         if html:
-            return '<a href="{}{}">{}</a>'.format(file, anchor, label)
-        return "[{0}]({1}{2})".format(label, file, anchor)
+            return '<a href="{}">{}</a>'.format(url, label)
+        return "[{0}]({1})".format(label, url)
 
     def code_span(self, txt):
         return "<code>{}</code>".format(txt)
@@ -123,9 +148,7 @@ class Target_Wiki(object):
         ]
 
     def markdown_block(self, text=[]):
-        out = text
-        out.append("")
-        return out
+        return text + [""]
 
     def image_block(self, item_name, title, subtitle="", code=[], code_below=False, rel_url=None, **kwargs):
         out = []